@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""The countdown example written with signal-indexed State tables
+instead of if/elif state handlers.
+"""
+
+import ufarc
+
+
+class Countdown(ufarc.Ahsm):
+    def __init__(self, count=3):
+        super().__init__(Countdown.initial)
+        self.count = count
+
+
+    def initial(me, event):
+        print("initial")
+        me.te = ufarc.TimeEvent("TIME_TICK")
+        return me.tran(me, Countdown.counting)
+
+
+    counting = ufarc.State(ufarc.Hsm.top)
+
+    @counting.on("ENTRY")
+    def _counting_entry(me, event):
+        print("counting")
+        me.te.postIn(me, 1000) # milliseconds
+        return me.handled(me, event)
+
+    @counting.on("TIME_TICK")
+    def _counting_tick(me, event):
+        print(me.count)
+
+        if me.count == 0:
+            return me.tran(me, Countdown.done)
+        else:
+            me.count -= 1
+            me.te.postIn(me, 1000) # milliseconds
+            return me.handled(me, event)
+
+
+    done = ufarc.State(ufarc.Hsm.top)
+
+    @done.on("ENTRY")
+    def _done_entry(me, event):
+        print("done")
+        ufarc.Framework.stop()
+        return me.handled(me, event)
+
+
+if __name__ == "__main__":
+    sl = Countdown(10)
+    sl.start(0)
+
+    ufarc.Framework.run_forever()
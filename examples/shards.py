@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""Two shards (processes) that play ping-pong by posting to each other
+by name, then publish DONE to the subscribers in both shards.
+"""
+
+import os
+
+import ufarc
+import ufarc.shard
+
+
+class Player(ufarc.Ahsm):
+    def __init__(self, serves, count=5):
+        super().__init__(Player.initial)
+        self.serves = serves
+        self.count = count
+
+
+    def initial(me, event):
+        ufarc.Signal.register_many("BALL", "DONE")
+        ufarc.shard.subscribe("DONE", me)
+        return me.tran(me, Player.playing)
+
+
+    def playing(me, event):
+        sig = event[ufarc.Event.SIG_IDX]
+        if sig == ufarc.SIGNAL.ENTRY:
+            if me.serves:
+                ufarc.shard.post((ufarc.SIGNAL.BALL, 0), "pong")
+            return me.handled(me, event)
+
+        elif sig == ufarc.SIGNAL.BALL:
+            n = event[ufarc.Event.VAL_IDX]
+            print("shard %d (pid %d) got the ball: %d"
+                  % (ufarc.shard.index(), os.getpid(), n))
+            if n == me.count:
+                ufarc.shard.publish((ufarc.SIGNAL.DONE, None))
+            else:
+                ufarc.shard.post((ufarc.SIGNAL.BALL, n + 1),
+                                 "pong" if me.serves else "ping")
+            return me.handled(me, event)
+
+        elif sig == ufarc.SIGNAL.DONE:
+            print("shard %d done" % ufarc.shard.index())
+            ufarc.Framework.stop()
+            return me.handled(me, event)
+
+        return me.super(me, me.top)
+
+
+def setup_ping():
+    ping = Player(serves=True)
+    ping.start(0)
+    ufarc.shard.export("ping", ping)
+
+
+def setup_pong():
+    pong = Player(serves=False)
+    pong.start(0)
+    ufarc.shard.export("pong", pong)
+
+
+if __name__ == "__main__":
+    shards = ufarc.shard.ShardSet([setup_ping, setup_pong])
+    shards.start()
+    shards.join()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Measures the cost of the signal comparisons a state handler makes.
+
+"getattr" is the cost of the dict lookup through Signal.__getattr__
+that every SIGNAL.FOO access used to make.  "attribute" is SIGNAL.FOO
+now that registered signals are attributes of Signal.  "namespace" is
+an attribute of the namespace returned by Signal.register_many().
+"""
+
+import time
+
+import ufarc
+
+
+try:
+    ticks = time.ticks_us
+    diff = time.ticks_diff
+except AttributeError:
+    ticks = lambda: int(time.perf_counter() * 1000000)
+    diff = lambda a, b: a - b
+
+
+N = 100000
+
+SIG = ufarc.Signal.register_many("ALPHA", "BETA", "GAMMA", "DELTA")
+
+
+def getattr_lookup(sig):
+    getattr_ = ufarc.Signal.__getattr__
+    return (sig == getattr_("ALPHA") or sig == getattr_("BETA")
+            or sig == getattr_("GAMMA") or sig == getattr_("DELTA"))
+
+
+def attribute(sig):
+    return (sig == ufarc.SIGNAL.ALPHA or sig == ufarc.SIGNAL.BETA
+            or sig == ufarc.SIGNAL.GAMMA or sig == ufarc.SIGNAL.DELTA)
+
+
+def namespace(sig):
+    return (sig == SIG.ALPHA or sig == SIG.BETA
+            or sig == SIG.GAMMA or sig == SIG.DELTA)
+
+
+def measure(handler):
+    # The signal matches none of the comparisons so all four are made
+    sig = ufarc.SIGNAL.EMPTY
+    t0 = ticks()
+    for _ in range(N):
+        handler(sig)
+    return diff(ticks(), t0) * 1000 / N
+
+
+if __name__ == "__main__":
+    for handler in (getattr_lookup, attribute, namespace):
+        print("{0:>10}: {1:.1f} ns per handler call".format(
+            handler.__name__, measure(handler)))
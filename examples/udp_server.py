@@ -10,13 +10,18 @@ to the server.
 When a client is present, the server starts a timer
 to periodically echo back the most recently received message.
 When the client is gone, the server awaits the next datagram.
+The datagram endpoint is opened by a task that belongs to the opening
+state (see Ahsm.spawn()), so the Framework is not blocked while it opens.
 
 References:
 - https://www.pythonsheets.com/notes/python-asyncio.html
 - https://docs.python.org/3.4/library/asyncio.html
 """
 
-import uasyncio
+try:
+    import uasyncio
+except ImportError:
+    import asyncio as uasyncio
 
 import ufarc
 
@@ -37,15 +42,34 @@ class UdpServer:
 
 class UdpRelayAhsm(ufarc.Ahsm):
 
+    # A burst of datagrams replaces the oldest queued ones
+    # rather than filling the queue
+    QUEUE_POLICIES = {"NET_RXD": (ufarc.Ahsm.DROP_OLDEST, 24)}
+
     def initial(me, event):
         ufarc.Framework.subscribe("NET_ERR", me)
         ufarc.Framework.subscribe("NET_RXD", me)
+        ufarc.Signal.register("NET_OPEN")
         me.tmr = ufarc.TimeEvent("FIVE_COUNT")
+        return me.tran(me, UdpRelayAhsm.opening)
+
 
-        loop = uasyncio.get_event_loop()
-        server = loop.create_datagram_endpoint(UdpServer, local_addr=("localhost", UDP_PORT))
-        me.transport, me.protocol = loop.run_until_complete(server)
-        return me.tran(me, UdpRelayAhsm.waiting)
+    def opening(me, event):
+        sig = event[ufarc.Event.SIG_IDX]
+        if sig == ufarc.SIGNAL.ENTRY:
+            loop = uasyncio.get_event_loop()
+            me.spawn(loop.create_datagram_endpoint(UdpServer, local_addr=("localhost", UDP_PORT)), "NET_OPEN")
+            return me.handled(me, event)
+
+        elif sig == ufarc.SIGNAL.NET_OPEN:
+            result = event[ufarc.Event.VAL_IDX]
+            if isinstance(result, Exception):
+                print("Could not open UDP port {0}: {1}".format(UDP_PORT, result))
+                return me.handled(me, event)
+            me.transport, me.protocol = result
+            return me.tran(me, UdpRelayAhsm.waiting)
+
+        return me.super(me, me.top)
 
 
     def waiting(me, event):
@@ -104,10 +128,18 @@ class UdpRelayAhsm(ufarc.Ahsm):
         return me.super(me, me.top)
 
 
-    # Callbacks interact via messaging
+    # Callbacks interact via messaging.
+    # Datagrams may arrive at a high rate, so their events come from a pool.
+    # When every pooled event is in flight, a plain event is used instead.
+    _net_rxd_pool = ufarc.EventPool("NET_RXD", 16)
+
     @staticmethod
     def on_datagram(data, addr):
-        e = (ufarc.SIGNAL.NET_RXD, (data,addr))
+        pool = UdpRelayAhsm._net_rxd_pool
+        if len(pool):
+            e = pool.get((data,addr))
+        else:
+            e = ufarc.Event(ufarc.SIGNAL.NET_RXD, (data,addr))
         ufarc.Framework.publish(e)
 
     @staticmethod
@@ -120,9 +152,7 @@ if __name__ == "__main__":
     relay = UdpRelayAhsm(UdpRelayAhsm.initial)
     relay.start(0)
 
-    loop = uasyncio.get_event_loop()
     try:
-        loop.run_forever()
+        ufarc.Framework.run_forever()
     except KeyboardInterrupt:
-        ufarc.Framework.stop()
-    loop.close()
+        pass
@@ -2,14 +2,42 @@
 # Copyright 2019 Dean Hall.  See LICENSE file for details.
 # """
 
-#Desktop debug:
-#import asyncio as uasyncio
-import uasyncio
+try:
+    import uasyncio
+except ImportError:
+    # Desktop: the standard library's asyncio stands in for uasyncio
+    import asyncio as uasyncio
+
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+
+try:
+    from collections import namedtuple
+except ImportError:
+    from ucollections import namedtuple
+
+try:
+    import _thread
+except ImportError:
+    # A port without threads
+    _thread = None
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    # Desktop: microsecond ticks from the performance counter
+    from time import perf_counter
+    def ticks_us(): return int(perf_counter() * 1000000)
+    def ticks_diff(a, b): return a - b
 
 
 class Signal(object):
     # """An asynchronous stimulus that triggers reactions.
     # A unique identifier that, along with a value, specifies an Event.
+    # Registering a signal makes its id (an int) an attribute of Signal
+    # so that SIGNAL.signame is a plain attribute load.
     # p. 154
     # """
 
@@ -34,12 +62,28 @@ class Signal(object):
             # TODO: emit warning that signal is already registrered
             return Signal._registry[signame]
         else:
+            assert not hasattr(Signal, signame), (
+                    "Signal name {0} is reserved".format(signame))
             sigid = len(Signal._lookup)
             Signal._registry[signame] = sigid
             Signal._lookup.append(signame)
+            setattr(Signal, signame, sigid)
             return sigid
 
 
+    @staticmethod
+    def register_many(*signames):
+        # """Registers each signame that is not already registered.
+        # Returns a read-only namespace (a namedtuple) whose attributes
+        # are the signal numbers of the signames.  Bind it to a module
+        # global and compare against its attributes in hot state handlers.
+        # """
+        return namedtuple("Signals", signames)(
+            *[Signal.register(signame) for signame in signames])
+
+
+    # Only called for a signame that is not registered
+    # (registered signals are attributes of Signal)
     @staticmethod
     def __getattr__(signame):
         assert type(signame) is str
@@ -56,15 +100,21 @@ SIGNAL.register("ENTRY") # 1
 SIGNAL.register("EXIT")  # 2
 SIGNAL.register("INIT")  # 3
 SIGNAL.register("SIGTERM") # To Exit all states
+SIGNAL.register("QUEUE_HIGH") # An Ahsm's queue reached its high-water mark
+SIGNAL.register("QUEUE_LOW")  # and then drained to its low-water mark
 
 
 class Event(object):
     # """A tuple holding ( signal, value ).
+    # An instance of this class may be used in place of the tuple:
+    # it has sig and val attributes and indexes like the tuple.
     # This class holds constant values of Events
     # defined by the system and used within ufarc
     # and by user state machines
     # """
 
+    __slots__ = ("sig", "val")
+
     # Constants to index into an Event tuple
     SIG_IDX = 0
     VAL_IDX = 1
@@ -82,6 +132,83 @@ class Event(object):
     reserved = (EMPTY, ENTRY, EXIT, INIT)
 
 
+    def __init__(self, sig, val=None):
+        self.sig = sig
+        self.val = val
+
+
+    # Make indexing an Event instance work like indexing an Event tuple
+    # where index 0 holds the signal and index 1 holds the value
+    def __len__(self,):
+        return 2
+    def __getitem__(self, n):
+        if n == 0:
+            return self.sig
+        elif n == 1:
+            return self.val
+        else:
+            raise IndexError
+
+
+class PoolEvent(Event):
+    # """An Event that belongs to an EventPool.
+    # The Framework counts the queues that hold the Event
+    # and returns it to its pool when the count drops to zero.
+    # """
+
+    __slots__ = ("_pool", "_refs")
+
+    def __init__(self, sig, pool):
+        Event.__init__(self, sig)
+        self._pool = pool
+        self._refs = 0
+
+
+    def _unref(self,):
+        # """Called when a queue no longer holds the Event.
+        # """
+        self._refs -= 1
+        if self._refs == 0:
+            self._recycle()
+
+
+    def _recycle(self,):
+        self.val = None
+        self._pool._free.append(self)
+
+
+class EventPool(object):
+    # """A pool of preallocated Events of one signal for publishers of
+    # high-rate signals.  get() takes an Event from the pool and sets its
+    # value; the Framework returns the Event to the pool once every Ahsm it
+    # was posted to has dispatched it (QP-style reference counting).
+    # Once posted, an Event from a pool must be treated as immutable and
+    # a handler must not keep the Event itself after it returns
+    # (keep its value instead).
+    # """
+
+    def __init__(self, signame, n):
+        sigid = SIGNAL.register(signame)
+        self._free = [PoolEvent(sigid, self) for _ in range(n)]
+
+
+    def __len__(self,):
+        # """Returns the number of Events available in the pool.
+        # """
+        return len(self._free)
+
+
+    def get(self, val=None):
+        # """Returns an Event from the pool with the given value.
+        # Raises IndexError if the pool is empty.
+        # """
+        if not self._free:
+            raise IndexError("EventPool empty")
+        evt = self._free.pop()
+        evt.val = val
+        return evt
+
+
 class Hsm(object):
     # """A Hierarchical State Machine (HSM).
     # Full support for hierarchical state nesting.
@@ -102,6 +229,24 @@ class Hsm(object):
     # RET_EXIT
     # RET_INITIAL
 
+    # The exit and entry paths of a transition are found by asking each
+    # state handler for its superstate.  A class whose state handlers
+    # always return the same superstate may set CACHE_PATHS = True so that
+    # the hierarchy is learned once per class: the superstate of each state
+    # handler and the paths of each transition are cached in
+    # Hsm._path_cache, a dict keyed by the Hsm class whose value is
+    # ( superstates, transition paths ).  The cache is not checked
+    # against the handlers, so a class whose superstates may change
+    # at runtime (e.g. depend on an attribute) must not set it.
+    CACHE_PATHS = False
+    _path_cache = {}
+
+    # Work that belongs to a state (see Ahsm.offload() and Ahsm.spawn())
+    # is kept in a dict { state: [ work, ... ] } that is created
+    # when first needed.
+    # The work of a state is cancelled when the state exits.
+    _owned = None
+
 
     def __init__(self, initialState):
         # """Sets this Hsm's current state to Hsm.top(), the default state
@@ -119,10 +264,11 @@ class Hsm(object):
     # Helper functions to process reserved events through the current state
     @staticmethod
     def trig(me, state, signal): return state(me, Event.reserved[signal])
+    # While a state's ENTRY or EXIT action runs, it is the current state
     @staticmethod
-    def enter(me, state): return state(me, Event.ENTRY)
+    def enter(me, state): me.state = state; return state(me, Event.ENTRY)
     @staticmethod
-    def exit(me, state): return state(me, Event.EXIT)
+    def exit(me, state): me.state = state; return state(me, Event.EXIT)
 
     # Other helper functions
     @staticmethod
@@ -158,32 +304,25 @@ class Hsm(object):
         # The initial state MUST transition to another state
         assert me.initialState(me, event) == Hsm.RET_TRAN
 
+        supers = Hsm._caches(me)[0]
+
         # HSM starts in the top state
         t = Hsm.top
 
         # Drill into the target
         while True:
 
-            # Store the target of the initial transition
-            path = [me.state]
-
-            # From the designated initial state, record the path to top
-            Hsm.trig(me, me.state, SIGNAL.EMPTY)
-            while me.state != t:
-                path.append(me.state)
-                Hsm.trig(me, me.state, SIGNAL.EMPTY)
-
-            # Restore the target of the initial transition
-            me.state = path[0]
+            # Record the path from the target of the initial transition
+            # up to (but not including) the source
+            path = Hsm._path(me, me.state, t, supers)
             assert len(path) < 32 # MAX_NEST_DEPTH (32 is arbitrary)
 
-            # Perform ENTRY action for each state from after-top to initial
-            path.reverse()
-            for s in path:
+            # Perform ENTRY action for each state from after-source to target
+            for s in path[::-1]:
                 Hsm.enter(me, s)
 
-            # Current state becomes new source (-1 because path was reversed)
-            t = path[-1]
+            # Current state becomes new source
+            t = path[0]
 
             if Hsm.trig(me, t, SIGNAL.INIT) != Hsm.RET_TRAN:
                 break
@@ -204,62 +343,355 @@ class Hsm(object):
         t = me.state
 
         # Proceed to superstates if event is not handled
-        exit_path = []
         r = Hsm.RET_SUPER
         while r == Hsm.RET_SUPER:
             s = me.state
-            exit_path.append(s)
             r = s(me, event)    # invoke state handler
 
         # If the state handler indicates a transition
         if r == Hsm.RET_TRAN:
 
             # Store target of transition
-            t = me.state
-
-            # Record path to top
-            Hsm.trig(me, me.state, SIGNAL.EMPTY)
-            while me.state != Hsm.top:
-                exit_path.append(me.state)
-                Hsm.trig(me, me.state, SIGNAL.EMPTY)
-
-            # Record path from target to top
-            me.state = t
-            entry_path = []
-            r = Hsm.RET_TRAN
-            while me.state != Hsm.top:
-                entry_path.append(me.state)
-                Hsm.trig(me, me.state, SIGNAL.EMPTY)
+            target = me.state
 
-            # Find the Least Common Ancestor between the source and target
-            i = -1
-            while exit_path[i] == entry_path[i]:
-                i -= 1
-            n = len(exit_path) + i + 1
+            exit_path, entry_path, depth = Hsm._tranPaths(me, t, target)
+
+            tracer = Framework._tracer
+            if tracer is not None:
+                tracer.tran(me, t, target, depth)
 
             # Exit all states in the exit path
-            for st in exit_path[0:n]:
+            # and cancel any work that belongs to them
+            owned = me._owned
+            for st in exit_path:
                 r = Hsm.exit(me, st)
                 assert (r == Hsm.RET_SUPER) or (r == Hsm.RET_HANDLED)
+                if owned and st in owned:
+                    Hsm._cancelOwned(me, st)
 
             # Enter all states in the entry path
-            # This is done in the reverse order of the path
-            for st in entry_path[n::-1]:
+            for st in entry_path:
                 r = Hsm.enter(me, st)
                 assert r == Hsm.RET_HANDLED, (
                         "Expected ENTRY to return "
-                        "HANDLED transitioning to {0}".format(t))
+                        "HANDLED transitioning to {0}".format(target))
 
             # Arrive at the target state
-            me.state = t
+            t = target
 
         # Restore the current state
         me.state = t
 
 
+    @staticmethod
+    def _cancelOwned(me, state=None):
+        # """Cancels the work that belongs to the given state
+        # (or to every state if state is None).  Returns the work.
+        # """
+        owned = me._owned
+        if not owned:
+            return ()
+        if state is None:
+            works = [w for ws in owned.values() for w in ws]
+            owned.clear()
+        else:
+            works = owned.pop(state, ())
+        for work in works:
+            work.cancel()
+        return works
+
+
+    @staticmethod
+    def _caches(me):
+        # """Returns the ( superstates, transition paths ) caches
+        # of the Hsm's class; empty ones if the class does not cache paths.
+        # """
+        if not me.CACHE_PATHS:
+            return {}, {}
+        cls = type(me)
+        caches = Hsm._path_cache.get(cls)
+        if caches is None:
+            caches = ({}, {})
+            Hsm._path_cache[cls] = caches
+        return caches
+
+
+    @staticmethod
+    def _path(me, state, stop, supers):
+        # """Returns the list of states from the given state up to
+        # (but not including) the stop state.  Each state's superstate is
+        # found by triggering the state with the EMPTY signal
+        # unless it is in the superstates cache.
+        # """
+        path = []
+        while state != stop:
+            path.append(state)
+            superstate = supers.get(state)
+            if superstate is None:
+                Hsm.trig(me, state, SIGNAL.EMPTY)
+                superstate = me.state
+                supers[state] = superstate
+            state = superstate
+        return path
+
+
+    @staticmethod
+    def _tranPaths(me, leaf, target):
+        # """Returns ( exit path, entry path, LCA depth ) for a transition
+        # to the target made while the Hsm is in the leaf state.
+        # The exit path is in the order states are exited (leaf first)
+        # and the entry path is in the order states are entered
+        # (target last).  The LCA depth is the number of states below top
+        # that the transition neither exits nor enters.
+        # The paths are cached per Hsm class.
+        # """
+        supers, trans = Hsm._caches(me)
+        key = (leaf, target)
+        paths = trans.get(key)
+        if paths is None:
+            exit_path = Hsm._path(me, leaf, Hsm.top, supers)
+            entry_path = Hsm._path(me, target, Hsm.top, supers)
+
+            # Find the Least Common Ancestor between the source and target
+            # by counting the states the paths share (from top down).
+            # The target is always entered, so a transition to the source or
+            # to one of its superstates exits and re-enters the target.
+            ne = len(exit_path)
+            nn = len(entry_path)
+            n = 0
+            while (n < ne and n < nn - 1
+                    and exit_path[ne - 1 - n] == entry_path[nn - 1 - n]):
+                n += 1
+
+            paths = (tuple(exit_path[:ne - n]),
+                     tuple(entry_path[nn - n - 1::-1]),
+                     n)
+            trans[key] = paths
+        return paths
+
+
+class State(object):
+    # """A state whose handler is a table of actions indexed by signal;
+    # a fast alternative to a state handler method that compares the
+    # signal in a chain of if/elif statements.
+    # Actions are declared in the body of an Hsm subclass:
+    #
+    #   class Blinky(ufarc.Ahsm):
+    #       blinking = ufarc.State(ufarc.Hsm.top)
+    #
+    #       @blinking.on("ENTRY")
+    #       def _blinking_entry(me, event):
+    #           me.te.postEvery(me, 500)
+    #           return me.handled(me, event)
+    #
+    # An action is called like a state handler and must return one of
+    # the Hsm.RET_* values via me.handled(), me.tran() or me.super().
+    # An event whose signal has no action goes straight to the superstate
+    # without calling any handler.  A State may be used wherever a state
+    # handler method may: as the target of a transition, as the superstate
+    # of a handler or of another State.
+    # """
+
+    def __init__(self, superstate=Hsm.top):
+        self.superstate = superstate
+        # The action table: a dict of signal (int) to action
+        self._actions = {}
+
+
+    def __set_name__(self, owner, name):
+        # Name the State like the handler method it stands in for
+        self.__name__ = name
+        self.__qualname__ = owner.__name__ + "." + name
+
+
+    def on(self, *signames):
+        # """Returns a decorator that makes the decorated function
+        # this State's action for the named signals.
+        # """
+        def decorator(action):
+            for signame in signames:
+                self._actions[SIGNAL.register(signame)] = action
+            return action
+        return decorator
+
+
+    def __call__(self, me, event):
+        action = self._actions.get(event[Event.SIG_IDX])
+        if action:
+            return action(me, event)
+        me.state = self.superstate
+        return Hsm.RET_SUPER
+
+
+class Timing(object):
+    # """Running statistics of a duration in microseconds:
+    # the count, min, mean and max, and a histogram of power-of-two buckets
+    # from which percentiles are estimated (to within a factor of two).
+    # """
+
+    def __init__(self,):
+        self.n = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+        # hist[i] counts the durations that need i bits
+        self.hist = [0] * 32
+
+
+    def add(self, us):
+        if self.n == 0 or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+        self.n += 1
+        self.total += us
+        i = 0
+        while us > 0 and i < 31:
+            us >>= 1
+            i += 1
+        self.hist[i] += 1
+
+
+    def percentile(self, p):
+        # """Returns an upper bound of the p-th percentile duration.
+        # """
+        target = self.n * p / 100
+        cum = 0
+        for i in range(32):
+            cum += self.hist[i]
+            if cum >= target:
+                return min((1 << i) - 1, self.max)
+        return self.max
+
+
+    def summary(self,):
+        return {"n": self.n, "min": self.min,
+                "mean": self.total / self.n if self.n else 0,
+                "p99": self.percentile(99), "max": self.max}
+
+
+class TimerHeap(object):
+    # """The default TimeEvent scheduler (timer backend) of the Framework.
+    # A binary heap of [expiration, sequence number, TimeEvent] entries.
+    # The sequence number makes TimeEvents with the same expiration
+    # fire in the order they were armed.  Arming is O(log n).
+    # Disarming is O(1): the entry is marked cancelled (its TimeEvent is
+    # set to None) and is discarded when it reaches the top of the heap.
+    #
+    # A timer backend provides:
+    # - push(tm_event, expiration, now): arms (or re-arms) the TimeEvent
+    # - discard(tm_event): disarms the TimeEvent if it is armed
+    # - peek(): the time at which the next TimeEvent is due, or None
+    # - pop(now): removes and returns ( expiration, time event )
+    #   for the next TimeEvent due at or before now, or None
+    # - len(): the number of armed TimeEvents
+    # - clear(): disarms every TimeEvent
+    # """
+
+    def __init__(self,):
+        self._heap = []
+        self._seq = 0
+        self._cnt = 0
+
+
+    def __len__(self,):
+        return self._cnt
+
+
+    def push(self, tm_event, expiration, now):
+        # """Arms the TimeEvent to expire at the given time.
+        # A TimeEvent that is already armed is re-armed.
+        # """
+        self.discard(tm_event)
+        entry = [expiration, self._seq, tm_event]
+        self._seq += 1
+        tm_event._tm_entry = entry
+        heapq.heappush(self._heap, entry)
+        self._cnt += 1
+
+
+    def clear(self,):
+        for entry in self._heap:
+            if entry[2] is not None:
+                entry[2]._tm_entry = None
+        self._heap = []
+        self._cnt = 0
+
+
+    def discard(self, tm_event):
+        # """Disarms the TimeEvent.
+        # """
+        entry = tm_event._tm_entry
+        if entry:
+            entry[2] = None
+            tm_event._tm_entry = None
+            self._cnt -= 1
+
+            # Rebuild the heap if it is mostly cancelled entries
+            if len(self._heap) > 2 * self._cnt + 16:
+                self._heap = [e for e in self._heap if e[2] is not None]
+                heapq.heapify(self._heap)
+
+
+    def _top(self,):
+        # """Returns the live entry at the top of the heap, or None.
+        # """
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0]
+        return None
+
+
+    def peek(self,):
+        entry = self._top()
+        if entry:
+            return entry[0]
+        return None
+
+
+    def pop(self, now):
+        entry = self._top()
+        if entry and entry[0] <= now:
+            heapq.heappop(self._heap)
+            tm_event = entry[2]
+            tm_event._tm_entry = None
+            self._cnt -= 1
+            return entry[0], tm_event
+        return None
+
+
+class LoopClock(object):
+    # """The Framework's clock (the default): the event loop's time,
+    # and callbacks scheduled in the event loop.
+    #
+    # A clock provides time(), call_at(time, callback) (which returns
+    # a handle with a cancel() method), call_soon(callback, *args),
+    # run_forever(), stop() and close().  See Framework.setClock().
+    # """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.time = loop.time
+        self.call_soon = loop.call_soon
+        self.run_forever = loop.run_forever
+        self.stop = loop.stop
+        self.close = loop.close
+        # Desktop: asyncio's loop has call_at(time, callback, *args)
+        # in place of uasyncio's call_at_(time, callback, args)
+        self._call_at = getattr(loop, "call_at_", None)
+
+
+    def call_at(self, time, callback):
+        if self._call_at is None:
+            return self._loop.call_at(time, callback)
+        return self._call_at(time, callback, ())
+
+
 class Framework(object):
     # """Framework is a composite class that holds:
-    # - the uasyncio event loop
+    # - the uasyncio event loop and the clock
     # - the registry of AHSMs
     # - the set of TimeEvents
     # - the handle to the next TimeEvent
@@ -268,9 +700,9 @@ class Framework(object):
 
     _event_loop = uasyncio.get_event_loop()
 
-    # Desktop debug:
-    if not hasattr(_event_loop, "call_at_"):
-        _event_loop.call_at_ = _event_loop.call_at
+    # The clock that times TimeEvents and schedules runs to completion
+    # (see Framework.setClock())
+    _clock = LoopClock(_event_loop)
 
     # The Framework maintains a registry of Ahsms in a list.
     _ahsm_registry = []
@@ -283,31 +715,116 @@ class Framework(object):
     # The dict's key is the priority (integer) and the value is the Ahsm.
     _priority_dict = {}
 
-    # The Framework maintains a group of TimeEvents in a list.
-    # The entries in the list are ( expiration time, time event ).  Only
-    # the event with the next/smallest expiration time is scheduled for the
-    # timeEventCallback().  As TimeEvents are added and removed, the scheduled
-    # callback must be re-evaluated.  Periodic TimeEvents should only have
-    # one entry in the list: the next expiration.  The timeEventCallback() will
-    # add a Periodic TimeEvent back into the list with its next expiration.
-    _time_events = []
+    # The ready set is a heap holding the priority of every Ahsm
+    # whose message queue is not empty.  A priority is pushed when an Ahsm's
+    # queue goes from empty to non-empty and popped when the queue is
+    # emptied, so the head of the heap is always the highest priority
+    # (smallest number) Ahsm that has an event to dispatch.
+    _ready = []
+
+    # The Ahsms whose queues pop_msg() drained to their low-water mark.
+    # run() publishes QUEUE_LOW for them once the Ahsm has left the ready
+    # set, so that an Ahsm subscribed to QUEUE_LOW is not put in it twice
+    _lows = []
+
+    # True while a call to run() is pending in the event loop or running.
+    # This latch lets rtc() schedule at most one run() at a time
+    # no matter how many events are posted in a burst.
+    _rtc_pending = False
+
+    # The most events run() dispatches before yielding to the event loop.
+    # A longer burst is continued by a run() in a later turn of the loop
+    # so that I/O and timer callbacks are not starved.  Zero means no limit.
+    RTC_BUDGET = 64
+
+    # The Framework keeps the armed TimeEvents in a timer backend
+    # (a TimerHeap unless replaced by Framework.setTimerBackend()).
+    # Only the next/smallest expiration is scheduled for the
+    # timeEventCallback().  Periodic TimeEvents only have one entry
+    # in the backend: the next expiration.  The timeEventCallback() will
+    # put a Periodic TimeEvent back in the backend with its next expiration.
+    _time_events = TimerHeap()
 
     # When a TimeEvent is scheduled for the timeEventCallback(),
-    # a handle is kept so that the callback may be cancelled if necessary.
+    # a handle is kept so that the callback may be cancelled if necessary,
+    # along with the time for which the callback is scheduled.
     _tm_event_handle = None
+    _tm_event_time = None
+
+    # Counts of timeEventCallback() wakeups and of the TimeEvents they fired
+    # [wakeups, TimeEvents fired, fired by the last wakeup, most fired by a wakeup]
+    _tm_stats = [0, 0, 0, 0]
 
     # The Subscriber Table is a dictionary.  The keys are signals.
     # The value for each key is a list of Ahsms that are subscribed to the
-    # signal.  An Ahsm may subscribe to a signal at any time during runtime.
+    # signal.  An Ahsm may subscribe to a signal at any time during runtime,
+    # even before it is started.
     _subscriber_table = {}
 
+    # The Ahsms that subscribed before they were started
+    # and so are last in their subscriber lists
+    _unstarted_subscribers = set()
+
+    # Events posted or published from other threads wait in the inbox,
+    # a list of ( event, ahsm ) pairs (ahsm is None to publish the event),
+    # until the event loop drains it in bulk.  The lock guards the inbox
+    # and the flag that is True while a drain is scheduled.
+    _inbox = []
+    _inbox_lock = _thread.allocate_lock() if _thread else None
+    _inbox_scheduled = False
+
+    # True while Ahsms are instrumented (see Framework.instrument())
+    _instrumented = False
+
+    # The tracer that records dispatches, transitions, publishes
+    # and TimeEvent expirations, or None (see Framework.setTracer())
+    _tracer = None
+
+    # The recorder that logs every event posted and published
+    # and every TimeEvent expiration, or None (see Framework.setRecorder())
+    _recorder = None
+
+    # True while run() is dispatching events
+    _running = False
+
+    # The executor that runs work offloaded by Ahsms (see Ahsm.offload()).
+    # A process pool is created when first needed
+    # unless an executor is given to Framework.setExecutor().
+    _executor = None
+
+    # The tasks of Ahsms (see Ahsm.spawn()) that stop() cancelled,
+    # which run_forever() lets finish before it closes the event loop
+    _stopped_tasks = []
+
 
     @staticmethod
     def post(event, ahsm):
         # """Posts the event to the given Ahsm's event queue.
+        # Returns False if the queue is at or above its high-water mark
+        # (see Ahsm.setWatermarks()) so the producer may back off.
         # """
-        assert isinstance(ahsm, Hsm)
+        assert isinstance(ahsm, (Hsm, LiteAhsm))
+        if Framework._recorder is not None:
+            Framework._recorder.post(event, ahsm)
         ahsm.postFIFO(event)
+        # A pooled event that a queue policy dropped goes back to its pool
+        if event.__class__ is PoolEvent and not event._refs:
+            event._recycle()
+        return not ahsm.isHigh()
+
+
+    @staticmethod
+    async def post_async(event, ahsm):
+        # """Posts the event to the given Ahsm's event queue, first
+        # suspending the calling coroutine while the queue is at or above
+        # its high-water mark until it drains to its low-water mark.
+        # Without watermarks this is the same as post().
+        # """
+        while ahsm.isHigh():
+            waiter = Framework._event_loop.create_future()
+            ahsm._wm[3].append(waiter)
+            await waiter
+        Framework.post(event, ahsm)
 
 
     @staticmethod
@@ -315,24 +832,211 @@ class Framework(object):
         # """Posts the event to the message queue of every Ahsm
         # that is subscribed to the event's signal.
         # """
-        if event[Event.SIG_IDX] in Framework._subscriber_table:
-            for ahsm in Framework._subscriber_table[event[Event.SIG_IDX]]:
-                ahsm.postFIFO(event)
+        if Framework._recorder is not None:
+            Framework._recorder.publish(event)
+        Framework._fanOut(event)
+
+        # Run to completion
+        Framework.rtc()
+
+
+    @staticmethod
+    def post_threadsafe(event, ahsm):
+        # """Posts the event to the given Ahsm's event queue.
+        # May be called from any thread.
+        # """
+        Framework._toInbox(event, ahsm)
+
+
+    @staticmethod
+    def publish_threadsafe(event):
+        # """Publishes the event.  May be called from any thread.
+        # """
+        Framework._toInbox(event, None)
+
+
+    @staticmethod
+    def _toInbox(event, ahsm):
+        # """Puts the event in the inbox and wakes the event loop
+        # to drain it unless a drain is already scheduled,
+        # so a batch of events costs a single wakeup.
+        # """
+        lock = Framework._inbox_lock
+        if lock:
+            lock.acquire()
+        Framework._inbox.append((event, ahsm))
+        wake = not Framework._inbox_scheduled
+        Framework._inbox_scheduled = True
+        if lock:
+            lock.release()
+
+        if wake:
+            loop = Framework._event_loop
+            try:
+                getattr(loop, "call_soon_threadsafe", loop.call_soon)(
+                    Framework._drainInbox)
+            except:
+                # Let the next event try to wake the loop
+                if lock:
+                    lock.acquire()
+                Framework._inbox_scheduled = False
+                if lock:
+                    lock.release()
+                raise
+
+
+    @staticmethod
+    def _drainInbox():
+        # """Posts or publishes every event in the inbox
+        # and then schedules a single run to completion.
+        # An event that does not fit in a full queue does not keep
+        # the rest of the inbox from being delivered; the first such
+        # IndexError is raised once they have been.
+        # """
+        lock = Framework._inbox_lock
+        if lock:
+            lock.acquire()
+        inbox = Framework._inbox
+        Framework._inbox = []
+        Framework._inbox_scheduled = False
+        if lock:
+            lock.release()
+
+        recorder = Framework._recorder
+        overflow = None
+        try:
+            for event, ahsm in inbox:
+                try:
+                    if ahsm is None:
+                        if recorder is not None:
+                            recorder.publish(event)
+                        Framework._fanOut(event)
+                    else:
+                        if recorder is not None:
+                            recorder.post(event, ahsm)
+                        ahsm.postFIFO(event)
+                except IndexError as e:
+                    if overflow is None:
+                        overflow = e
+                if event.__class__ is PoolEvent and not event._refs:
+                    event._recycle()
+        finally:
+            # Run to completion
+            Framework.rtc()
+
+        if overflow is not None:
+            raise overflow
+
+
+    @staticmethod
+    def publish_many(events):
+        # """Publishes each of the events (in order)
+        # and then schedules a single run to completion.
+        # """
+        recorder = Framework._recorder
+        for event in events:
+            if recorder is not None:
+                recorder.publish(event)
+            Framework._fanOut(event)
+
         # Run to completion
         Framework.rtc()
 
 
     @staticmethod
-    def subscribe(signame, ahsm):
+    def _fanOut(event):
+        # """Posts the event to each subscriber of its signal
+        # in priority order.
+        # """
+        subscribers = Framework._subscriber_table.get(event[Event.SIG_IDX], ())
+        for ahsm in subscribers:
+            ahsm.postFIFO(event)
+
+        if Framework._tracer is not None:
+            Framework._tracer.publish(event, len(subscribers))
+
+        # A pooled event that no Ahsm subscribes to goes back to its pool
+        if event.__class__ is PoolEvent and not event._refs:
+            event._recycle()
+
+
+    @staticmethod
+    def subscribe(signame, ahsm, policy=None, hwm=None):
         # """Adds the given Ahsm to the subscriber table list
         # for the given signal.  The argument, signame, is a string of the name
         # of the Signal to which the Ahsm is subscribing.  Using a string allows
         # the Signal to be created in the registry if it is not already.
+        # Subscribing again has no effect.  Each list is kept in priority
+        # order so that publish() posts to the highest priority Ahsm first;
+        # an Ahsm that is not started yet (and so has no priority) is put
+        # last and moved to its place when it starts.
+        # A policy (and high-water mark) given here is set for the signal
+        # with ahsm.setQueuePolicy().
         # """
         sigid = SIGNAL.register(signame)
+        if policy is not None:
+            ahsm.setQueuePolicy(signame, policy, hwm)
         if sigid not in Framework._subscriber_table:
             Framework._subscriber_table[sigid] = []
-        Framework._subscriber_table[sigid].append(ahsm)
+        subscribers = Framework._subscriber_table[sigid]
+        if ahsm not in subscribers:
+            prio = getattr(ahsm, "priority", None)
+            i = 0
+            if prio is not None:
+                while (i < len(subscribers)
+                        and getattr(subscribers[i], "priority", None) is not None
+                        and subscribers[i].priority < prio):
+                    i += 1
+            else:
+                i = len(subscribers)
+                Framework._unstarted_subscribers.add(ahsm)
+            subscribers.insert(i, ahsm)
+
+
+    @staticmethod
+    def _sortSubscribers(ahsm):
+        # """Puts the (just started) Ahsm in its place in the priority order
+        # of the signals it subscribed to before it started.
+        # """
+        if ahsm not in Framework._unstarted_subscribers:
+            return
+        Framework._unstarted_subscribers.discard(ahsm)
+
+        def key(subscriber):
+            prio = getattr(subscriber, "priority", None)
+            return (prio is None, prio or 0)
+        for subscribers in Framework._subscriber_table.values():
+            if ahsm in subscribers:
+                subscribers.sort(key=key)
+
+
+    @staticmethod
+    def unsubscribe(signame, ahsm):
+        # """Removes the given Ahsm from the subscriber table list
+        # for the given signal (if it is subscribed).
+        # """
+        sigid = Signal._registry.get(signame)
+        if sigid in Framework._subscriber_table:
+            Framework._unsubscribe(sigid, ahsm)
+
+
+    @staticmethod
+    def unsubscribe_all(ahsm):
+        # """Removes the given Ahsm from every subscriber table list.
+        # """
+        for sigid in list(Framework._subscriber_table):
+            Framework._unsubscribe(sigid, ahsm)
+
+
+    @staticmethod
+    def _unsubscribe(sigid, ahsm):
+        subscribers = Framework._subscriber_table[sigid]
+        if ahsm in subscribers:
+            subscribers.remove(ahsm)
+
+            # Signals with no subscribers are kept out of the table
+            if not subscribers:
+                del Framework._subscriber_table[sigid]
 
 
     @staticmethod
@@ -341,7 +1045,7 @@ class Framework(object):
         # The event will fire its signal (to the TimeEvent's target Ahsm)
         # after the delay, delta.
         # """
-        expiration = Framework._event_loop.time() + delta
+        expiration = Framework._clock.time() + delta
         Framework._insortTimeEvent(tm_event, expiration)
 
 
@@ -349,21 +1053,41 @@ class Framework(object):
     def addTimeEventAt(tm_event, expiration):
         # """Adds the TimeEvent to the list of time events in the Framework.
         # The event will fire its signal (to the TimeEvent's target Ahsm)
-        # at the given absolute time (_event_loop.time()).
+        # at the given absolute time (Framework's clock time()).
         # """
         Framework._insortTimeEvent(tm_event, expiration)
 
 
+    @staticmethod
+    def setClock(clock):
+        # """Replaces the Framework's clock (a LoopClock of the event loop)
+        # e.g. with a ufarc.clock.VirtualClock to simulate time.
+        # run_forever() and stop() run and stop the clock.
+        # This must be done while no TimeEvents are armed.
+        # """
+        assert len(Framework._time_events) == 0, (
+                "TimeEvents are armed")
+        Framework._clock = clock
+
+
+    @staticmethod
+    def setTimerBackend(backend):
+        # """Replaces the Framework's TimeEvent scheduler
+        # (see TimerHeap for the interface a backend provides).
+        # This must be done while no TimeEvents are armed.
+        # """
+        assert len(Framework._time_events) == 0, (
+                "TimeEvents are armed")
+        Framework._time_events = backend
+
+
     @staticmethod
     def _insortTimeEvent(tm_event, expiration):
-        # """Inserts a TimeEvent into the list of time events,
-        # sorted by the next expiration of the timer.
-        # If the expiration time matches an existing expiration,
-        # we add the smallest amount of time to the given expiration
-        # to avoid a key collision in the Dict
-        # and make the identically-timed events fire in a FIFO fashion.
+        # """Arms the TimeEvent in the timer backend to expire at the given
+        # time and makes sure the timeEventCallback() is scheduled
+        # no later than the next expiration.
         # """
-        now = Framework._event_loop.time()
+        now = Framework._clock.time()
 
         # If the expiration is to happen in the past, post it now
         if expiration < now:
@@ -373,95 +1097,119 @@ class Framework(object):
             if tm_event.interval > 0:
                 expiration = now + tm_event.interval
 
-        # Else (the expiration is to happen in the future)
-        else:
-
-            # If this is the only active TimeEvent, schedule its callback
-            if len(Framework._time_events) == 0:
-                Framework._tm_event_handle = Framework._event_loop.call_at_(
-                    expiration, Framework.timeEventCallback, (tm_event, expiration))
-
-            # If this event expires before the next one in the list,
-            # cancel any current event and schedule this one
-            elif expiration < Framework._time_events[0][0]:
-                if Framework._tm_event_handle:
-                    Framework._tm_event_handle.cancel()
-                Framework._tm_event_handle = Framework._event_loop.call_at_(
-                    expiration, Framework.timeEventCallback, (tm_event,
-                    expiration))
+            # Else the one-shot TimeEvent is done
+            else:
+                Framework._time_events.discard(tm_event)
+                return
 
-        # Put this event in the list and sort the list by expiration
-        entry = (expiration, tm_event)
-        Framework._time_events.append(entry)
-        Framework._time_events.sort(key=lambda x: x[0])
+        Framework._time_events.push(tm_event, expiration, now)
+        Framework._scheduleTimeEventCallback()
 
 
     @staticmethod
-    def removeTimeEvent(tm_event):
-        # """Removes the TimeEvent from the list of active time events.
-        # Cancels the TimeEvent's callback if there is one.
-        # Schedules the next event's callback if there is one.
+    def _scheduleTimeEventCallback():
+        # """Schedules the timeEventCallback() for the next expiration
+        # unless it is already scheduled at or before that time.
         # """
-        assert len(Framework._time_events) > 0
+        expiration = Framework._time_events.peek()
+        if expiration is None:
+            return
 
-        # If the event being removed is scheduled for callback,
-        entry = Framework._time_events[0]
-        if tm_event == entry[1]:
+        if Framework._tm_event_handle:
+            if Framework._tm_event_time <= expiration:
+                return
+            Framework._tm_event_handle.cancel()
 
-            # Remove the entry
-            del Framework._time_events[0]
+        Framework._tm_event_time = expiration
+        Framework._tm_event_handle = Framework._clock.call_at(
+            expiration, Framework.timeEventCallback)
 
-            # Cancel any active time event
-            if Framework._tm_event_handle:
-                Framework._tm_event_handle.cancel()
-                Framework._tm_event_handle = None
 
-            # Schedule the next event if there is one
-            if Framework._time_events:
-                next_expiration, next_event = Framework._time_events[0]
-                Framework._tm_event_handle = Framework._event_loop.call_at_(
-                    next_expiration, Framework.timeEventCallback,
-                    (next_event, next_expiration))
+    @staticmethod
+    def removeTimeEvent(tm_event):
+        # """Removes the TimeEvent from the active time events.
+        # If the callback is scheduled for this TimeEvent, it is left to
+        # find nothing expired and schedule itself for the next TimeEvent;
+        # if no TimeEvents remain, the callback is cancelled.
+        # """
+        Framework._time_events.discard(tm_event)
 
-        # Else (the event being removed is NOT scheduled for callback)
-        # so just remove the event
-        else:
-            for entry in Framework._time_events:
-                if tm_event == entry[1]:
-                    Framework._time_events.remove(entry)
-                    break
+        if len(Framework._time_events) == 0 and Framework._tm_event_handle:
+            Framework._tm_event_handle.cancel()
+            Framework._tm_event_handle = None
 
 
     @staticmethod
-    def timeEventCallback(tm_event, expiration):
+    def timeEventCallback():
         # """The callback function for all TimeEvents.
-        # Posts the event to the event's target Ahsm.
-        # If the TimeEvent is periodic, re-insort the event
-        # in the list of active time events.
+        # Posts every expired event to its target Ahsm.
+        # If a TimeEvent is periodic, re-arm the event
+        # with its next expiration.  Then schedules the callback for the
+        # next expiration and a single run to completion.
         # """
-
-        # Remove this expired TimeEvent from the active list
-        del Framework._time_events[0]
+        # The loop may run a callback a little before its time,
+        # so treat the scheduled time as now
+        now = Framework._clock.time()
+        if now < Framework._tm_event_time:
+            now = Framework._tm_event_time
         Framework._tm_event_handle = None
 
-        # Post the event to the target Ahsm
-        tm_event.ahsm.postFIFO(tm_event)
+        time_events = Framework._time_events
+        fired = 0
+        try:
+            entry = time_events.pop(now)
+            while entry:
+                expiration, tm_event = entry
+
+                # If this is a periodic time event, schedule its next
+                # expiration (before posting, which may raise if the
+                # target's queue is full).  If that is already past,
+                # post it again now and schedule the one after that.
+                late = False
+                if tm_event.interval > 0:
+                    expiration += tm_event.interval
+                    if expiration < now:
+                        late = True
+                        expiration = now + tm_event.interval
+                    time_events.push(tm_event, expiration, now)
+
+                # Post the event to the target Ahsm
+                tm_event.ahsm.postFIFO(tm_event)
+                fired += 1
+                if Framework._tracer is not None:
+                    Framework._tracer.timer(tm_event)
+                if Framework._recorder is not None:
+                    Framework._recorder.timer(tm_event)
+                if late:
+                    tm_event.ahsm.postFIFO(tm_event)
+                    fired += 1
+
+                entry = time_events.pop(now)
 
-        # If this is a periodic time event, schedule its next expiration
-        if tm_event.interval > 0:
-            Framework._insortTimeEvent(tm_event,
-                expiration + tm_event.interval)
+        finally:
+            stats = Framework._tm_stats
+            stats[0] += 1
+            stats[1] += fired
+            stats[2] = fired
+            if fired > stats[3]:
+                stats[3] = fired
 
-        # If not set already and there are more events, set the next event callback
-        if (Framework._tm_event_handle == None and
-                len(Framework._time_events) > 0):
-            next_expiration, next_event = Framework._time_events[0]
-            Framework._tm_event_handle = Framework._event_loop.call_at_(
-                next_expiration, Framework.timeEventCallback, (next_event,
-                next_expiration))
+            # If there are more events, set the next event callback
+            # (even if a post raised, so the other TimeEvents still expire)
+            Framework._scheduleTimeEventCallback()
 
-        # Run to completion
-        Framework.rtc()
+            # Run to completion
+            Framework.rtc()
+
+
+    @staticmethod
+    def timerStats():
+        # """Returns a dict of counts of the timeEventCallback() wakeups
+        # and of the TimeEvents they fired.
+        # """
+        wakeups, fired, last, most = Framework._tm_stats
+        return {"wakeups": wakeups, "fired": fired,
+                "fired_last": last, "fired_max": most}
 
 
     @staticmethod
@@ -472,46 +1220,233 @@ class Framework(object):
         assert ahsm.priority not in Framework._priority_dict, (
                 "Priority MUST be unique")
         Framework._priority_dict[ahsm.priority] = ahsm
+        Framework._sortSubscribers(ahsm)
+        if Framework._instrumented and isinstance(ahsm, Ahsm):
+            Framework._instrumentAhsm(ahsm)
 
 
     @staticmethod
-    def run():
+    def setTracer(tracer):
+        # """Sets the tracer (e.g. a ufarc.trace.Tracer) that records
+        # every dispatch, transition, publish and TimeEvent expiration.
+        # None turns tracing off.
+        # """
+        Framework._tracer = tracer
+
+
+    @staticmethod
+    def setRecorder(recorder):
+        # """Sets the recorder (e.g. a ufarc.replay.Recorder) that logs
+        # every event posted with post() and published and every
+        # TimeEvent expiration.  None turns recording off.
+        # """
+        Framework._recorder = recorder
+
+
+    @staticmethod
+    def instrument(enable=True):
+        # """Turns the instrumentation of every Ahsm on or off.
+        # While on, the Framework records for each Ahsm
+        # the time each dispatch takes, the latency from posting an event
+        # to dispatching it and the most events ever in its queue.
+        # Turning it on clears what was recorded.  See Framework.stats().
+        #
+        # Instrumentation replaces an Ahsm's postFIFO(), postLIFO()
+        # and dispatch() with timed versions (instance attributes),
+        # so it costs nothing while off.
+        # """
+        Framework._instrumented = enable
+        for ahsm in Framework._ahsm_registry:
+            if not isinstance(ahsm, Ahsm):
+                continue
+            if enable:
+                Framework._instrumentAhsm(ahsm)
+            elif "dispatch" in ahsm.__dict__:
+                del ahsm.postFIFO
+                del ahsm.postLIFO
+                del ahsm.dispatch
+                ahsm.mq._stamps = None
+
+
+    @staticmethod
+    def _instrumentAhsm(ahsm):
+        # """Gives the Ahsm timed versions of postFIFO(), postLIFO()
+        # and dispatch() that record into ahsm._stats:
+        # [ dispatch Timing, latency Timing, queue high-water mark ].
+        # The time each event is posted is kept in a list parallel to
+        # the slots of the Ahsm's queue.
+        # """
+        stats = [Timing(), Timing(), len(ahsm.mq)]
+        ahsm._stats = stats
+        mq = ahsm.mq
+        stamps = [None] * mq.maxlen
+        mq._stamps = stamps
+        cls = type(ahsm)
+        post_fifo = cls.postFIFO
+        post_lifo = cls.postLIFO
+        dispatch = cls.dispatch
+
+        def postFIFO(evt):
+            post_fifo(ahsm, evt)
+            # A queue policy may have coalesced or dropped the event
+            i = (mq._head + mq._cnt - 1) % mq.maxlen
+            if mq._buf[i] is evt:
+                stamps[i] = ticks_us()
+            if mq._cnt > stats[2]:
+                stats[2] = mq._cnt
+
+        def postLIFO(evt):
+            post_lifo(ahsm, evt)
+            stamps[mq._head] = ticks_us()
+            if mq._cnt > stats[2]:
+                stats[2] = mq._cnt
+
+        # Framework.run() calls this just after taking the event from the
+        # queue, so the event's time stamp is in the slot before the head
+        def timed_dispatch(me, event):
+            t0 = ticks_us()
+            i = (mq._head - 1) % mq.maxlen
+            posted = stamps[i]
+            stamps[i] = None
+            dispatch(me, event)
+            stats[0].add(ticks_diff(ticks_us(), t0))
+            if posted is not None:
+                stats[1].add(ticks_diff(t0, posted))
+
+        ahsm.postFIFO = postFIFO
+        ahsm.postLIFO = postLIFO
+        ahsm.dispatch = timed_dispatch
+
+
+    @staticmethod
+    def stats():
+        # """Returns a snapshot of what the instrumentation recorded
+        # (see Framework.instrument()) as a dict with the TimeEvent counts
+        # of Framework.timerStats() and, for each instrumented Ahsm,
+        # keyed by priority: its class name, the number of events in and
+        # the size of its queue, the queue's high-water mark, the number of
+        # events deferred and the defer() overflows, the events coalesced
+        # or dropped by its queue policies, and summaries
+        # (n, min, mean, p99, max in microseconds) of its dispatch times
+        # and post-to-dispatch latencies.
+        # """
+        ahsms = {}
+        for ahsm in Framework._ahsm_registry:
+            stats = getattr(ahsm, "_stats", None)
+            if stats:
+                ahsms[ahsm.priority] = {
+                    "name": type(ahsm).__name__,
+                    "queue_len": len(ahsm.mq),
+                    "queue_max": ahsm.mq.maxlen,
+                    "queue_hwm": stats[2],
+                    "deferred": len(ahsm.deferred),
+                    "defer_overflows": ahsm.defer_overflows,
+                    "queue_policies": ahsm.queuePolicyStats(),
+                    "dispatch_us": stats[0].summary(),
+                    "latency_us": stats[1].summary(),
+                }
+        return {"instrumented": Framework._instrumented,
+                "timers": Framework.timerStats(),
+                "ahsms": ahsms}
+
+
+    @staticmethod
+    def run(budget=None):
         # """Dispatches an event to the highest priority Ahsm
         # until all event queues are empty (i.e. Run To Completion).
+        # At most budget events are dispatched (Framework.RTC_BUDGET
+        # if not given, no limit if zero); if events remain after that,
+        # another run() is scheduled in the event loop.
         # """
-        getPriority = lambda x : x.priority
-
-        while True:
-            allQueuesEmpty = True
-            sorted_acts = sorted(Framework._ahsm_registry, key=getPriority)
-            for ahsm in sorted_acts:
-                if ahsm.has_msgs():
-                    event_next = ahsm.pop_msg()
-                    ahsm.dispatch(ahsm, event_next)
-                    allQueuesEmpty = False
+        if budget is None:
+            budget = Framework.RTC_BUDGET
+        ready = Framework._ready
+        lows = Framework._lows
+        tracer = Framework._tracer
+
+        # Events posted while running are dispatched by this run()
+        # so rtc() must not schedule another one
+        Framework._rtc_pending = True
+        Framework._running = True
+        try:
+            while ready:
+                ahsm = Framework._priority_dict[ready[0]]
+                event_next = ahsm.pop_msg()
+
+                # Leave the ready set before dispatching so that
+                # an Ahsm that posts to itself is put back in the ready set
+                if not ahsm.has_msgs():
+                    heapq.heappop(ready)
+                while lows:
+                    Framework._fanOut((SIGNAL.QUEUE_LOW, lows.pop(0)))
+
+                if tracer is not None:
+                    tracer.dispatch(ahsm, event_next)
+                ahsm.dispatch(ahsm, event_next)
+
+                # The Ahsm's queue no longer holds a pooled event
+                if event_next.__class__ is PoolEvent:
+                    event_next._unref()
+
+                budget -= 1
+                if budget == 0:
                     break
-            if allQueuesEmpty:
-                return
+        finally:
+            Framework._rtc_pending = False
+            Framework._running = False
+
+        # If the budget was spent, yield to the event loop and continue later
+        if ready:
+            Framework.rtc()
 
 
     @staticmethod
     def rtc():
         # """Runs a state machine handler to completion
         # in an asyncio's call_soon context.
+        # Does nothing if a run() is already pending.
         # """
-        Framework._event_loop.call_soon(Framework.run)
+        if not Framework._rtc_pending:
+            Framework._rtc_pending = True
+            Framework._clock.call_soon(Framework.run)
 
 
     @staticmethod
     def run_forever():
-        # """Calls uasyncio's event loop's run_forever() within a try/finally
+        # """Calls the clock's (by default uasyncio's event loop's)
+        # run_forever() within a try/finally
         # to ensure state machines' exit handlers are executed.
         # """
         try:
-            Framework._event_loop.run_forever()
+            Framework._clock.run_forever()
         finally:
             Framework.stop()
-            Framework._event_loop.close()
+            if Framework._stopped_tasks:
+                # A loop that is told to stop before it runs makes one pass,
+                # in which the cancelled tasks finish
+                Framework._stopped_tasks = []
+                Framework._event_loop.stop()
+                Framework._event_loop.run_forever()
+            Framework._clock.close()
+
+
+    @staticmethod
+    def setExecutor(executor):
+        # """Sets the concurrent.futures executor that runs offloaded work.
+        # Give a ThreadPoolExecutor for work that releases the GIL
+        # or cannot be pickled.  The Framework shuts it down in stop().
+        # """
+        Framework._executor = executor
+
+
+    @staticmethod
+    def executor():
+        # """Returns the executor that runs offloaded work.
+        # """
+        if Framework._executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            Framework._executor = ProcessPoolExecutor()
+        return Framework._executor
 
 
     @staticmethod
@@ -523,13 +1458,150 @@ class Framework(object):
             Framework._tm_event_handle.cancel()
             Framework._tm_event_handle = None
 
-        # Post SIGTERM to all Ahsms so they execute their EXIT handler
+        try:
+            # Post SIGTERM to all Ahsms (each member of a group)
+            # so they execute their EXIT handler.  An Ahsm whose queue
+            # is full gets SIGTERM once run() has drained its queue.
+            full = []
+            for ahsm in Framework._ahsm_registry:
+                targets = (ahsm.members if isinstance(ahsm, AhsmGroup)
+                           else (ahsm,))
+                for target in targets:
+                    try:
+                        target.postFIFO(Event.SIGTERM)
+                    except IndexError:
+                        full.append(target)
+
+            # Run to completion (without a budget)
+            # so each Ahsm will process SIGTERM
+            Framework.run(0)
+            if full:
+                for target in full:
+                    target.postFIFO(Event.SIGTERM)
+                Framework.run(0)
+
+        finally:
+            # Cancel the offloaded work and tasks that have not finished
+            for ahsm in Framework._ahsm_registry:
+                for work in Hsm._cancelOwned(ahsm):
+                    if isinstance(work, _TaskWork):
+                        Framework._stopped_tasks.append(work.future)
+            if Framework._executor is not None:
+                Framework._executor.shutdown(wait=False)
+                Framework._executor = None
+
+            Framework._clock.stop()
+
+
+    @staticmethod
+    def reset():
+        # """Forgets every Ahsm, subscription and armed TimeEvent
+        # so the Framework may be used afresh (e.g. between benchmarks).
+        # Does not run any EXIT handlers; see stop() for that.
+        # """
+        if Framework._tm_event_handle:
+            Framework._tm_event_handle.cancel()
+            Framework._tm_event_handle = None
+        Framework._time_events.clear()
+        Framework._tm_stats = [0, 0, 0, 0]
         for ahsm in Framework._ahsm_registry:
-            Framework.post(Event.SIGTERM, ahsm)
+            Hsm._cancelOwned(ahsm)
+            # Resume the producers suspended in post_async()
+            if isinstance(ahsm, Ahsm) and ahsm._wm is not None:
+                ahsm._release()
+        Framework._stopped_tasks = []
+        Framework._ahsm_registry = []
+        Framework._priority_dict = {}
+        Framework._ready = []
+        del Framework._lows[:]
+        Framework._rtc_pending = False
+        Framework._subscriber_table = {}
+        Framework._unstarted_subscribers = set()
+        Framework._inbox = []
+        Framework._inbox_scheduled = False
+        Framework._instrumented = False
+        Framework._tracer = None
+        Framework._recorder = None
+
+
+class EventQueue(object):
+    # """A fixed-capacity ring buffer of Events.
+    # All storage is allocated when the queue is created so that posting
+    # never allocates.  Events are put at the tail (FIFO) or at the head
+    # (LIFO) and are always taken from the head.  Every operation is O(1).
+    # Putting to a full queue raises IndexError rather than growing.
+    # """
+
+    # A list parallel to the slots that is kept in step
+    # when remove() moves Events (see Framework._instrumentAhsm())
+    _stamps = None
+
+
+    def __init__(self, maxlen):
+        assert maxlen > 0
+        self.maxlen = maxlen
+        self._buf = [None] * maxlen
+        self._head = 0  # index of the next Event to get
+        self._cnt = 0   # number of Events in the queue
+
+
+    def __len__(self,):
+        return self._cnt
+
+
+    def putFIFO(self, evt):
+        # """Puts the Event at the tail of the queue.
+        # """
+        if self._cnt == self.maxlen:
+            raise IndexError("EventQueue full ({0} events)".format(self.maxlen))
+        self._buf[(self._head + self._cnt) % self.maxlen] = evt
+        self._cnt += 1
+
+
+    def putLIFO(self, evt):
+        # """Puts the Event at the head of the queue
+        # so it is the next one to be taken.
+        # """
+        if self._cnt == self.maxlen:
+            raise IndexError("EventQueue full ({0} events)".format(self.maxlen))
+        self._head = (self._head - 1) % self.maxlen
+        self._buf[self._head] = evt
+        self._cnt += 1
+
 
-        # Run to completion so each Ahsm will process SIGTERM
-        Framework.run()     # TODO: rtc() here?
-        Framework._event_loop.stop()
+    def get(self,):
+        # """Removes and returns the Event at the head of the queue.
+        # """
+        if self._cnt == 0:
+            raise IndexError("EventQueue empty")
+        evt = self._buf[self._head]
+        # Drop the queue's reference so the Event may be collected
+        self._buf[self._head] = None
+        self._head = (self._head + 1) % self.maxlen
+        self._cnt -= 1
+        return evt
+
+
+    def remove(self, n):
+        # """Removes and returns the nth Event from the head of the queue
+        # and moves the Events behind it up by one.  O(n).
+        # """
+        assert 0 <= n < self._cnt
+        buf = self._buf
+        stamps = self._stamps
+        i = (self._head + n) % self.maxlen
+        evt = buf[i]
+        for k in range(n + 1, self._cnt):
+            j = (self._head + k) % self.maxlen
+            buf[i] = buf[j]
+            if stamps:
+                stamps[i] = stamps[j]
+            i = j
+        buf[i] = None
+        if stamps:
+            stamps[i] = None
+        self._cnt -= 1
+        return evt
 
 
 class Ahsm(Hsm):
@@ -537,58 +1609,573 @@ class Ahsm(Hsm):
     # Adds a priority, message queue and methods to work with the queue.
     # """
 
-    def start(self, priority, initEvent=None):
+    # The default capacity of an Ahsm's message queue, which a subclass
+    # may override.  A different capacity may be given to Ahsm.start().
+    MQ_LEN = 32
+
+    # The default capacity of an Ahsm's deferred event queue (see defer()),
+    # which a subclass may override.
+    # A different capacity may be given to Ahsm.start().
+    DEFER_LEN = 4
+
+    # The queue's watermarks (see setWatermarks()), a list of
+    # [ high, low, True while high, futures awaiting low ]
+    # or None while there are none
+    _wm = None
+
+    # Queue policies for high-rate signals (see setQueuePolicy())
+    COALESCE = "coalesce"
+    DROP_NEWEST = "drop-newest"
+    DROP_OLDEST = "drop-oldest"
+
+    # The queue policies set by start(), a dict whose key is a signame
+    # and whose value is a policy or a ( policy, high-water mark ) tuple
+    QUEUE_POLICIES = {}
+
+    # The queue policies in effect, a dict whose key is a signal and
+    # whose value is [ policy, high-water mark, count, slot ] where count
+    # is the number of events coalesced or dropped and slot is where the
+    # last event was put (for coalescing).  None while there are none.
+    _policies = None
+
+
+    def start(self, priority, initEvent=None, mq_len=None, defer_len=None):
         # must set the priority before Framework.add() which uses the priority
         self.priority = priority
+        self.mq = EventQueue(mq_len or self.MQ_LEN)
+        self.deferred = EventQueue(defer_len or self.DEFER_LEN)
+        # The number of events defer() could not keep
+        self.defer_overflows = 0
+        for signame, policy in self.QUEUE_POLICIES.items():
+            if type(policy) is tuple:
+                self.setQueuePolicy(signame, *policy)
+            else:
+                self.setQueuePolicy(signame, policy)
         Framework.add(self)
-        self.mq = []
         self.init(self, initEvent)
         # Run to completion
         Framework.rtc()
 
     def postLIFO(self, evt):
-        self.mq.append(evt)
+        self.mq.putLIFO(evt)
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        if len(self.mq) == 1:
+            heapq.heappush(Framework._ready, self.priority)
+        if self._wm is not None:
+            self._checkHigh()
 
     def postFIFO(self, evt):
-        self.mq.insert(0,evt)
+        if self._policies is not None:
+            policy = self._policies.get(evt[Event.SIG_IDX])
+            if policy is not None and self._applyPolicy(evt, policy):
+                return
+        self.mq.putFIFO(evt)
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        if len(self.mq) == 1:
+            heapq.heappush(Framework._ready, self.priority)
+        if self._wm is not None:
+            self._checkHigh()
+
+    def setQueuePolicy(self, signame, policy, hwm=None):
+        # """Sets what postFIFO() does with an event of the given signal
+        # (or, if policy is None, stops doing it):
+        #   COALESCE: the event replaces, in place, an event of the same
+        #       signal that is still queued (only the newest value matters)
+        #   DROP_NEWEST: the event is dropped if the queue holds hwm events
+        #   DROP_OLDEST: if the queue holds hwm events, the oldest queued
+        #       event of the same signal is dropped and the event is queued
+        # The high-water mark (hwm) defaults to the queue's capacity.
+        # Events posted with postLIFO() are always queued.
+        # """
+        assert policy in (None, Ahsm.COALESCE, Ahsm.DROP_NEWEST,
+                          Ahsm.DROP_OLDEST)
+        sigid = SIGNAL.register(signame)
+        if self._policies is None:
+            self._policies = {}
+        if policy is None:
+            self._policies.pop(sigid, None)
+        else:
+            self._policies[sigid] = [policy, hwm, 0, None]
+
+    def queuePolicyStats(self,):
+        # """Returns { signame: ( policy, events coalesced or dropped ) }.
+        # """
+        return {Signal._lookup[sigid]: (p[0], p[2])
+                for sigid, p in (self._policies or {}).items()}
+
+    def _applyPolicy(self, evt, policy):
+        # """Applies the signal's policy to the event being posted.
+        # Returns True if it took care of the event
+        # or False if the event is still to be queued.
+        # """
+        mq = self.mq
+        kind = policy[0]
+        if kind == Ahsm.COALESCE:
+            # The slot where the last event of the signal was put still
+            # holds an event of the signal if it has not been dispatched
+            i = policy[3]
+            policy[3] = (mq._head + mq._cnt) % mq.maxlen
+            if i is None or (i - mq._head) % mq.maxlen >= mq._cnt:
+                return False
+            old = mq._buf[i]
+            if old[Event.SIG_IDX] != evt[Event.SIG_IDX]:
+                return False
+            mq._buf[i] = evt
+            policy[3] = i
+
+        else:
+            if len(mq) < (policy[1] or mq.maxlen):
+                return False
+            if kind == Ahsm.DROP_NEWEST:
+                policy[2] += 1
+                return True
+
+            # DROP_OLDEST
+            sig = evt[Event.SIG_IDX]
+            for n in range(mq._cnt):
+                if mq._buf[(mq._head + n) % mq.maxlen][Event.SIG_IDX] == sig:
+                    break
+            else:
+                return False
+            old = mq.remove(n)
+            mq.putFIFO(evt)
+
+        policy[2] += 1
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        if old.__class__ is PoolEvent:
+            old._unref()
+        return True
 
     def pop_msg(self,):
-        return self.mq.pop()
+        evt = self.mq.get()
+        wm = self._wm
+        if wm is not None and wm[2] and len(self.mq) <= wm[1]:
+            self._toLow()
+        return evt
+
+    def setWatermarks(self, high, low=None):
+        # """Sets the queue's high-water mark and low-water mark
+        # (half the high-water mark if not given).  When a post fills
+        # the queue to the high-water mark, QUEUE_HIGH is published with
+        # this Ahsm as its value; when the queue then drains to the
+        # low-water mark, QUEUE_LOW is published and the producers
+        # suspended in Framework.post_async() resume.
+        # None removes the watermarks.  Changing or removing the watermarks
+        # resumes the suspended producers (which suspend again if the queue
+        # is still high).
+        # """
+        if high is not None:
+            if low is None:
+                low = high // 2
+            assert 0 <= low < high <= self.mq.maxlen
+        if self._wm is not None:
+            self._release()
+        if high is None:
+            self._wm = None
+            return
+        self._wm = [high, low, False, []]
+
+    def isHigh(self,):
+        # """Returns True if the queue reached its high-water mark
+        # and has not yet drained to its low-water mark.
+        # """
+        return self._wm is not None and self._wm[2]
+
+    def _checkHigh(self,):
+        wm = self._wm
+        if not wm[2] and len(self.mq) >= wm[0]:
+            wm[2] = True
+            Framework._fanOut((SIGNAL.QUEUE_HIGH, self))
+
+    def _toLow(self,):
+        self._wm[2] = False
+        self._release()
+        # run() publishes QUEUE_LOW
+        Framework._lows.append(self)
+
+    def _release(self,):
+        # """Resumes the producers suspended in Framework.post_async().
+        # """
+        wm = self._wm
+        waiters = wm[3]
+        wm[3] = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
 
     def has_msgs(self,):
         return len(self.mq) > 0
 
+    def defer(self, evt):
+        # """Keeps the event (usually the one being dispatched)
+        # to be recalled later, e.g. on entry to a state that can handle it.
+        # Returns False and counts an overflow if the deferred queue is full.
+        # """
+        deferred = self.deferred
+        if len(deferred) == deferred.maxlen:
+            self.defer_overflows += 1
+            return False
+        deferred.putFIFO(evt)
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        return True
+
+    def recall(self,):
+        # """Puts the oldest deferred event at the front of the queue
+        # so it is the next event dispatched after the current one.
+        # Returns False if there is no deferred event
+        # (or the queue is full and the event stays deferred).
+        # """
+        if not len(self.deferred) or len(self.mq) == self.mq.maxlen:
+            return False
+        evt = self.deferred.get()
+        self.postLIFO(evt)
+        # The deferred queue no longer holds a pooled event
+        if evt.__class__ is PoolEvent:
+            evt._unref()
+        return True
+
+    def offload(self, fn, args, done_signal, executor=None):
+        # """Runs fn(*args) in an executor (by default the Framework's
+        # process pool) so that a long computation does not block
+        # the Framework.  When fn returns, (done_signal, result) is posted
+        # to this Ahsm; if fn raises, (done_signal, exception) is posted.
+        # The work belongs to the current state (call offload() before
+        # tran()); if that state exits first, the work is cancelled
+        # and nothing is posted.  Returns the work's Future.
+        # """
+        assert type(done_signal) == str
+        if executor is None:
+            executor = Framework.executor()
+        work = _OffloadWork(self, SIGNAL.register(done_signal))
+        self._own(work)
+        work.future = executor.submit(fn, *args)
+        work.future.add_done_callback(work._done)
+        return work.future
+
+    def spawn(self, coro, done_signal=None):
+        # """Runs the coroutine as a task in the Framework's event loop
+        # so that a state may await I/O (e.g. asyncio streams or
+        # a datagram endpoint) without blocking the Framework.
+        # When the coroutine returns, (done_signal, result) is posted
+        # to this Ahsm; if it raises, (done_signal, exception) is posted.
+        # Without a done_signal nothing is posted.  While it runs,
+        # the coroutine may post events with Framework.post()
+        # followed by Framework.rtc(), or with Framework.publish().
+        # The task belongs to the current state (call spawn() in its
+        # ENTRY handler or before tran()); if that state exits first,
+        # the task is cancelled and nothing is posted.  Returns the task.
+        # """
+        sig = None
+        if done_signal is not None:
+            assert type(done_signal) == str
+            sig = SIGNAL.register(done_signal)
+        work = _TaskWork(self, sig)
+        self._own(work)
+        work.coro = coro
+        work.future = Framework._event_loop.create_task(work._run())
+        return work.future
+
+    def _own(self, work):
+        # """Makes the work belong to the current state.
+        # """
+        if self._owned is None:
+            self._owned = {}
+        self._owned.setdefault(self.state, []).append(work)
+        work.state = self.state
+
+
+class _OffloadWork(object):
+    # """Work offloaded by an Ahsm to an executor.
+    # The result is handed from the executor's thread to the event loop,
+    # which posts it unless the work was cancelled in the meantime.
+    # """
+
+    __slots__ = ("ahsm", "sig", "state", "future")
+
+    def __init__(self, ahsm, sig):
+        self.ahsm = ahsm
+        self.sig = sig
+        self.state = None
+        self.future = None
 
-class TimeEvent(object):
-    # """TimeEvent is a composite class that contains an Event.
+
+    def cancel(self,):
+        # """Stops the work if it has not started and drops its result.
+        # """
+        self.ahsm = None
+        self.future.cancel()
+
+
+    def _done(self, future):
+        # Runs in the executor's thread (or the caller's if already done)
+        if self.ahsm is None or future.cancelled():
+            return
+        try:
+            Framework._event_loop.call_soon_threadsafe(self._deliver)
+        except RuntimeError:
+            # The event loop is closed
+            pass
+
+
+    def _deliver(self,):
+        if self.ahsm is None:
+            return
+        exc = self.future.exception()
+        self._post(exc if exc is not None else self.future.result())
+
+
+    def _post(self, value):
+        # """Posts the work's result (if it has a signal)
+        # now that the work no longer belongs to the state.
+        # """
+        ahsm = self.ahsm
+        self.ahsm = None
+        works = ahsm._owned.get(self.state)
+        works.remove(self)
+        if not works:
+            del ahsm._owned[self.state]
+
+        if self.sig is not None:
+            ahsm.postFIFO(Event(self.sig, value))
+            Framework.rtc()
+
+
+class _TaskWork(_OffloadWork):
+    # """A coroutine run by an Ahsm as a task in the event loop
+    # (the task is kept as the work's future).
+    # """
+
+    __slots__ = ("coro",)
+
+    def __init__(self, ahsm, sig):
+        _OffloadWork.__init__(self, ahsm, sig)
+        self.coro = None
+
+
+    def cancel(self,):
+        # """Cancels the task (and closes the coroutine if it has not
+        # started) and drops its result.
+        # """
+        self.ahsm = None
+        self.future.cancel()
+        if self.coro is not None:
+            self.coro.close()
+            self.coro = None
+
+
+    async def _run(self,):
+        coro = self.coro
+        self.coro = None
+        try:
+            value = await coro
+        except uasyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.ahsm is None or self.sig is None:
+                # Left to the event loop's exception handler
+                if self.ahsm is not None:
+                    self._post(None)
+                raise
+            value = e
+        if self.ahsm is not None:
+            self._post(value)
+
+
+class LiteAhsm(object):
+    # """A compact Ahsm for when there are very many state machines
+    # (e.g. one per connection).  LiteAhsms are members of an AhsmGroup,
+    # which the Framework schedules at a single priority.
+    # A LiteAhsm has no __dict__ (a subclass declares __slots__ for its
+    # own attributes), shares its class's state handlers and path caches
+    # (so its states must always return the same superstate; a subclass
+    # whose superstates change sets CACHE_PATHS = False), and holds
+    # an event queue only while it has events to dispatch.
+    # It is posted to, subscribed and given TimeEvents like an Ahsm
+    # (but does not defer events or have queue policies or watermarks).
+    # """
+
+    __slots__ = ("state", "group", "mq")
+
+    CACHE_PATHS = True
+    _owned = None
+
+    # The Hsm helpers work on a LiteAhsm
+    trig = staticmethod(Hsm.trig)
+    enter = staticmethod(Hsm.enter)
+    exit = staticmethod(Hsm.exit)
+    handled = staticmethod(Hsm.handled)
+    tran = staticmethod(Hsm.tran)
+    super = staticmethod(Hsm.super)
+    top = staticmethod(Hsm.top)
+    init = staticmethod(Hsm.init)
+    dispatch = staticmethod(Hsm.dispatch)
+
+
+    def __init__(self,):
+        self.state = Hsm.top
+        self.group = None
+        self.mq = None
+
+
+    @property
+    def initialState(self,):
+        # The class's initial pseudostate, initial(me, event)
+        return type(self).initial
+
+
+    @property
+    def priority(self,):
+        return self.group.priority
+
+
+    def start(self, group, initEvent=None):
+        # """Adds this LiteAhsm to the (started) group
+        # and transitions to its initial state.
+        # """
+        self.group = group
+        group.members.append(self)
+        Framework._sortSubscribers(self)
+        self.init(self, initEvent)
+        # Run to completion
+        Framework.rtc()
+
+    def postLIFO(self, evt):
+        mq = self.mq
+        if mq is None:
+            mq = self.mq = self.group._queue()
+        mq.putLIFO(evt)
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        if len(mq) == 1:
+            self.group._makeReady(self)
+
+    def postFIFO(self, evt):
+        mq = self.mq
+        if mq is None:
+            mq = self.mq = self.group._queue()
+        mq.putFIFO(evt)
+        if evt.__class__ is PoolEvent:
+            evt._refs += 1
+        if len(mq) == 1:
+            self.group._makeReady(self)
+
+    def has_msgs(self,):
+        return self.mq is not None and len(self.mq) > 0
+
+    def isHigh(self,):
+        return False
+
+
+class AhsmGroup(object):
+    # """Schedules many LiteAhsms at one Framework priority.
+    # The group keeps a ready list of the members that have events
+    # and dispatches one event of each in turn (round robin),
+    # so members without events cost nothing.  A member is given an
+    # EventQueue (of capacity mq_len) from the group's free list when
+    # an event is posted to it and gives it back when it is emptied.
+    # """
+
+    _owned = None
+
+    def __init__(self, mq_len=4):
+        self.mq_len = mq_len
+        self.members = []
+        self._free = []     # EventQueues not in use
+        self._ready = []    # members with events, from index _next on
+        self._next = 0
+        self._current = None
+
+
+    def start(self, priority):
+        self.priority = priority
+        Framework.add(self)
+
+
+    @property
+    def state(self,):
+        # The state of the member whose event is being dispatched
+        return self._current.state
+
+
+    def _queue(self,):
+        if self._free:
+            return self._free.pop()
+        return EventQueue(self.mq_len)
+
+
+    def _makeReady(self, member):
+        if self._next == len(self._ready):
+            heapq.heappush(Framework._ready, self.priority)
+        self._ready.append(member)
+
+
+    def postFIFO(self, evt):
+        # """Posts the event to every member.
+        # """
+        for member in self.members:
+            member.postFIFO(evt)
+
+
+    def pop_msg(self,):
+        ready = self._ready
+        member = ready[self._next]
+        self._next += 1
+        evt = member.mq.get()
+        if len(member.mq):
+            ready.append(member)
+        else:
+            self._free.append(member.mq)
+            member.mq = None
+
+        # Drop the members already taken from the ready list
+        if self._next == len(ready):
+            del ready[:]
+            self._next = 0
+        elif self._next > 64 and self._next * 2 > len(ready):
+            del ready[:self._next]
+            self._next = 0
+
+        self._current = member
+        return evt
+
+
+    def has_msgs(self,):
+        return self._next < len(self._ready)
+
+
+    @staticmethod
+    def dispatch(me, event):
+        member = me._current
+        member.dispatch(member, event)
+
+
+class TimeEvent(Event):
+    # """TimeEvent is an Event that the Framework emits at a given time.
     # A TimeEvent is created by the application and added to the Framework.
     # The Framework then emits the event after the given delay.
     # A one-shot TimeEvent is created by calling either postAt() or postIn().
     # A periodic TimeEvent is created by calling the postEvery() method.
     # """
-    def __init__(self, signame):
-        assert type(signame) == str
-        self.signal = SIGNAL.register(signame)
-        self.value = None
 
+    __slots__ = ("ahsm", "interval", "_tm_entry")
 
-    # Make indexing a TimeEvent work like indexing an Event tuple
-    # where index 0 holds the signal and index 1 holds the value
-    def __len__(self,):
-        return 2
-    def __getitem__(self, n):
-        if n == 0:
-            return self.signal
-        elif n == 1:
-            return self.value
-        else:
-            raise IndexError
+    def __init__(self, signame):
+        assert type(signame) == str
+        Event.__init__(self, SIGNAL.register(signame))
+        self.ahsm = None
+        self.interval = 0
+        # The TimeEvent's entry in the timer backend while it is armed
+        self._tm_entry = None
 
 
     def postAt(self, ahsm, abs_time):
         # """Posts this TimeEvent to the given Ahsm at a specified time.
         # """
-        assert issubclass(type(ahsm), Ahsm)
+        assert isinstance(ahsm, (Ahsm, LiteAhsm))
         self.ahsm = ahsm
         self.interval = 0
         Framework.addTimeEventAt(self, abs_time)
@@ -597,7 +2184,7 @@ class TimeEvent(object):
     def postIn(self, ahsm, delta):
         # """Posts this TimeEvent to the given Ahsm after the time delta.
         # """
-        assert issubclass(type(ahsm), Ahsm)
+        assert isinstance(ahsm, (Ahsm, LiteAhsm))
         self.ahsm = ahsm
         self.interval = 0
         Framework.addTimeEvent(self, delta)
@@ -607,7 +2194,7 @@ class TimeEvent(object):
         # """Posts this TimeEvent to the given Ahsm after the time delta
         # and every time delta thereafter until disarmed.
         # """
-        assert issubclass(type(ahsm), Ahsm)
+        assert isinstance(ahsm, (Ahsm, LiteAhsm))
         self.ahsm = ahsm
         self.interval = delta
         Framework.addTimeEvent(self, delta)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# """Benchmarks of the ufarc Framework.
+#
+# Runs on the desktop, where the standard library's asyncio stands in
+# for uasyncio, and writes its results as JSON so runs may be compared
+# to track regressions:
+#
+#     $ python3 -m ufarc.bench -o bench.json
+#
+# Each benchmark times a fixed amount of work several times
+# and reports the best rate in operations per second.
+# """
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import ufarc
+from ufarc.timerwheel import TimerWheel
+
+
+SIGNAL = ufarc.Signal.register_many("BENCH", "BENCH_GO", "BENCH_TMR")
+
+
+class Sink(ufarc.Ahsm):
+    # """An Ahsm that handles every event it is sent.
+    # """
+
+    def __init__(self):
+        super().__init__(Sink.initial)
+
+
+    def initial(me, event):
+        return me.tran(me, Sink.sinking)
+
+
+    def sinking(me, event):
+        sig = event[ufarc.Event.SIG_IDX]
+        if sig == SIGNAL.BENCH or sig == SIGNAL.BENCH_TMR:
+            return me.handled(me, event)
+        return me.super(me, me.top)
+
+
+class LiteSink(ufarc.LiteAhsm):
+    # """A LiteAhsm that counts the events it is sent.
+    # """
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+
+    def initial(me, event):
+        return me.tran(me, LiteSink.sinking)
+
+
+    def sinking(me, event):
+        if event[ufarc.Event.SIG_IDX] == SIGNAL.BENCH:
+            me.count += 1
+            return me.handled(me, event)
+        return me.super(me, me.top)
+
+
+def deep_hsm(depth):
+    # """Returns an Hsm with two branches of nested states, depth deep,
+    # that transitions from the leaf of one branch to the leaf of the other
+    # on every BENCH_GO, so each transition exits and enters depth states.
+    # """
+    def state(superstate, branch, n):
+        def handler(me, event):
+            sig = event[ufarc.Event.SIG_IDX]
+            if sig == ufarc.SIGNAL.ENTRY or sig == ufarc.SIGNAL.EXIT:
+                return me.handled(me, event)
+            if sig == SIGNAL.BENCH_GO and n == depth - 1:
+                return me.tran(me, me.leaves[1 - branch])
+            return me.super(me, superstate)
+        return handler
+
+    class Deep(ufarc.Hsm):
+        pass
+
+    leaves = []
+    for branch in (0, 1):
+        superstate = ufarc.Hsm.top
+        for n in range(depth):
+            superstate = state(superstate, branch, n)
+            setattr(Deep, "s%d_%d" % (branch, n), superstate)
+        leaves.append(superstate)
+
+    hsm = Deep(lambda me, event: me.tran(me, leaves[0]))
+    hsm.leaves = leaves
+    hsm.init(hsm)
+    return hsm
+
+
+def rate(fn, ops, repeat):
+    # """Returns the best rate (ops per second) of repeat calls to fn().
+    # """
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        if best is None or dt < best:
+            best = dt
+    return ops / best
+
+
+def start_sinks(n, mq_len):
+    ufarc.Framework.reset()
+    sinks = [Sink() for _ in range(n)]
+    for priority, sink in enumerate(sinks):
+        sink.start(priority, mq_len=mq_len)
+    ufarc.Framework.run(0)
+    return sinks
+
+
+def bench_post(scale, repeat):
+    # """Events per second posted with Framework.post() and dispatched.
+    # """
+    batch = 1000
+    sink, = start_sinks(1, batch)
+    evt = (SIGNAL.BENCH, None)
+    post = ufarc.Framework.post
+
+    def work():
+        for _ in range(scale):
+            for _ in range(batch):
+                post(evt, sink)
+            ufarc.Framework.run(0)
+
+    return {"events_per_s": rate(work, scale * batch, repeat)}
+
+
+def bench_publish(scale, repeat):
+    # """Events per second delivered by Framework.publish()
+    # to N subscribers, keyed by N.
+    # """
+    results = {}
+    for nsubs in (1, 10, 100):
+        batch = 100
+        for sink in start_sinks(nsubs, batch):
+            ufarc.Framework.subscribe("BENCH", sink)
+        evt = (SIGNAL.BENCH, None)
+        publish = ufarc.Framework.publish
+        npub = max(1, scale * 10 // nsubs)
+
+        def work():
+            for _ in range(npub):
+                for _ in range(batch):
+                    publish(evt)
+                ufarc.Framework.run(0)
+
+        results[str(nsubs)] = {
+            "deliveries_per_s": rate(work, npub * batch * nsubs, repeat)}
+    return results
+
+
+def bench_transition(scale, repeat):
+    # """Transitions per second through Hsm.dispatch() between the leaves
+    # of two branches of depth D (exiting and entering D states each), keyed
+    # by D, with the path cache and without it (CACHE_PATHS = False).
+    # """
+    results = {}
+    evt = (SIGNAL.BENCH_GO, None)
+    for depth in (2, 4, 8):
+        result = {}
+        for cached in (True, False):
+            hsm = deep_hsm(depth)
+            type(hsm).CACHE_PATHS = cached
+            dispatch = ufarc.Hsm.dispatch
+            ntran = scale * 100
+
+            def work():
+                for _ in range(ntran):
+                    dispatch(hsm, evt)
+
+            key = "cached_per_s" if cached else "uncached_per_s"
+            result[key] = rate(work, ntran, repeat)
+        results[str(depth)] = result
+    return results
+
+
+def bench_timers(scale, repeat):
+    # """TimeEvents per second armed (TimeEvent.postIn), disarmed
+    # (TimeEvent.disarm) and expired (Framework.timeEventCallback)
+    # with N (100 and scale * 1000) armed TimeEvents, keyed by timer backend
+    # and N.
+    # """
+    results = {}
+    backends = (("heap", ufarc.TimerHeap), ("wheel", lambda: TimerWheel(0.001)))
+    for name, backend in backends:
+        for ntmr in sorted({100, scale * 1000}):
+            ufarc.Framework.reset()
+            ufarc.Framework.setTimerBackend(backend())
+            sink, = start_sinks(1, ntmr)
+            tmrs = [ufarc.TimeEvent("BENCH_TMR") for _ in range(ntmr)]
+
+            # Spread the expirations over a second so the backend has depth
+            def arm():
+                for n, tmr in enumerate(tmrs):
+                    tmr.postIn(sink, 1.0 + n / ntmr)
+
+            def disarm():
+                for tmr in tmrs:
+                    tmr.disarm()
+
+            def arm_disarm():
+                arm()
+                disarm()
+
+            # Time only the callback that fires every TimeEvent.
+            # It is called as if it were the loop at a time
+            # after every expiration.
+            def expire():
+                for tmr in tmrs:
+                    tmr.postIn(sink, 0.0001)
+                tm = time.perf_counter()
+                ufarc.Framework._tm_event_time = (
+                    ufarc.Framework._clock.time() + 0.001)
+                ufarc.Framework.timeEventCallback()
+                dt = time.perf_counter() - tm
+                ufarc.Framework.run(0)
+                return dt
+
+            best_expire = min(expire() for _ in range(repeat))
+            results["%s_%d" % (name, ntmr)] = {
+                "arm_disarm_per_s": rate(arm_disarm, ntmr, repeat),
+                "expire_per_s": ntmr / best_expire,
+            }
+    ufarc.Framework.reset()
+    ufarc.Framework.setTimerBackend(ufarc.TimerHeap())
+    return results
+
+
+def bench_run(scale, repeat):
+    # """Events per second dispatched by Framework.run()
+    # when each of N Ahsms has one event, keyed by N.
+    # """
+    results = {}
+    evt = (SIGNAL.BENCH, None)
+    for nahsm in (10, 100, 1000):
+        sinks = start_sinks(nahsm, 1)
+        rounds = max(1, scale * 100 // nahsm)
+
+        def work():
+            for _ in range(rounds):
+                for sink in sinks:
+                    sink.postFIFO(evt)
+                ufarc.Framework.run(0)
+
+        results[str(nahsm)] = {
+            "events_per_s": rate(work, rounds * nahsm, repeat)}
+    return results
+
+
+def bench_lite(scale, repeat):
+    # """LiteAhsms (scale * 10000 of them in one AhsmGroup): the memory
+    # allocated per instance, instances started per second and events
+    # per second dispatched when a thousand of them have one event each.
+    # """
+    n = scale * 10000
+    ufarc.Framework.reset()
+    group = ufarc.AhsmGroup()
+    group.start(0)
+
+    tracemalloc.start()
+    mem0 = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    sinks = [LiteSink() for _ in range(n)]
+    for sink in sinks:
+        sink.start(group)
+    dt = time.perf_counter() - t0
+    mem = tracemalloc.get_traced_memory()[0] - mem0
+    tracemalloc.stop()
+    ufarc.Framework.run(0)
+
+    evt = (SIGNAL.BENCH, None)
+    active = sinks[::max(1, n // 1000)]
+    rounds = max(1, scale * 10)
+
+    def work():
+        for _ in range(rounds):
+            for sink in active:
+                sink.postFIFO(evt)
+            ufarc.Framework.run(0)
+
+    return {"instances": n,
+            "bytes_per_instance": mem / n,
+            "starts_per_s": n / dt,
+            "events_per_s": rate(work, rounds * len(active), repeat)}
+
+
+BENCHMARKS = {
+    "post": bench_post,
+    "publish": bench_publish,
+    "transition": bench_transition,
+    "timers": bench_timers,
+    "run": bench_run,
+    "lite": bench_lite,
+}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+            description="Benchmarks of the ufarc Framework")
+    parser.add_argument("-o", "--output",
+            help="write the JSON results to this file (default: stdout)")
+    parser.add_argument("-s", "--scale", type=int, default=10,
+            help="amount of work per benchmark (default: %(default)s)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+            help="times each benchmark is repeated (default: %(default)s)")
+    parser.add_argument("names", nargs="*", metavar="name",
+            help="benchmarks to run: %s (default: all)"
+                 % ", ".join(sorted(BENCHMARKS)))
+    args = parser.parse_args(args)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+
+    results = {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "scale": args.scale,
+        "benchmarks": {},
+    }
+    for name in args.names or sorted(BENCHMARKS):
+        results["benchmarks"][name] = BENCHMARKS[name](args.scale, args.repeat)
+    ufarc.Framework.reset()
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+# """
+
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+
+
+class VirtualTimer(object):
+    # """A callback scheduled by VirtualClock.call_at().
+    # """
+
+    __slots__ = ("time", "seq", "callback", "args")
+
+    def __init__(self, time, seq, callback, args):
+        self.time = time
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+
+    def cancel(self,):
+        self.callback = None
+
+
+class VirtualClock(object):
+    # """A discrete-event clock that simulates time (a Framework clock)
+    # so timer-driven behaviour runs as fast as the Ahsms can dispatch:
+    #
+    #   ufarc.Framework.setClock(VirtualClock())
+    #   countdown.start(0)
+    #   ufarc.Framework.run_forever()
+    #
+    # Callbacks scheduled with call_soon() (e.g. runs to completion) are
+    # run first, in order.  Only when none remain, i.e. every queue is idle,
+    # does the time jump straight to the next timer and run its callback.
+    # Timers that are due at the same time run in the order they were
+    # scheduled, so events happen in the same order as in real time.
+    #
+    # The clock runs in the calling thread, without the event loop,
+    # so it does not serve I/O or events posted from other threads.
+    # """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._timers = []   # heap of VirtualTimers
+        self._soon = []     # ( callback, args ) to run before any timer
+        self._seq = 0
+        self._stopped = False
+
+
+    def time(self,):
+        return self._now
+
+
+    def call_at(self, time, callback, *args):
+        timer = VirtualTimer(time, self._seq, callback, args)
+        self._seq += 1
+        heapq.heappush(self._timers, timer)
+        return timer
+
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self._now + delay, callback, *args)
+
+
+    def call_soon(self, callback, *args):
+        self._soon.append((callback, args))
+
+
+    def run_forever(self,):
+        self.run()
+
+
+    def run(self, until=None, inclusive=True):
+        # """Runs the callbacks, advancing the time to each timer
+        # as it comes due, until stop() is called, nothing is left to run,
+        # or the next timer is after the time until (or at it, if not
+        # inclusive), in which case the time is advanced to until.
+        # Returns the time.
+        # """
+        self._stopped = False
+        timers = self._timers
+        while not self._stopped:
+            if self._soon:
+                soon = self._soon
+                self._soon = []
+                for i in range(len(soon)):
+                    callback, args = soon[i]
+                    callback(*args)
+                    if self._stopped:
+                        # Keep the rest for the next run
+                        self._soon[:0] = soon[i + 1:]
+                        break
+                continue
+
+            # Idle: jump to the next timer
+            while timers and timers[0].callback is None:
+                heapq.heappop(timers)
+            if not timers:
+                break
+            if until is not None and (timers[0].time > until or
+                    (not inclusive and timers[0].time == until)):
+                break
+            timer = heapq.heappop(timers)
+            if timer.time > self._now:
+                self._now = timer.time
+            timer.callback(*timer.args)
+
+        if until is not None and until > self._now and not self._stopped:
+            self._now = until
+        return self._now
+
+
+    def stop(self,):
+        self._stopped = True
+
+
+    def close(self,):
+        pass
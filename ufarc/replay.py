@@ -0,0 +1,241 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+#
+# Records the events that drive the Framework and replays them offline,
+# e.g. to benchmark the Ahsms with a real workload or to compare
+# versions of ufarc on the same traffic.
+#
+# A Recorder appends every event posted (Framework.post()), published
+# and every TimeEvent expiration to a compact binary log, with the
+# clock time at which it happened:
+#
+#   recorder = ufarc.replay.Recorder("traffic.log")
+#   ufarc.Framework.setRecorder(recorder)
+#   ...
+#   recorder.close()
+#
+# A Replayer feeds the events that came from outside the Ahsms (those not
+# posted or published by a handler while dispatching) to the same Ahsms,
+# started afresh with the same priorities, under a VirtualClock
+# so that their TimeEvents expire as they did.  It drives Framework.run()
+# directly, at full speed or scaled to the recorded time:
+#
+#   replayer = ufarc.replay.Replayer("traffic.log")   # sets the clock
+#   ... start the Ahsms ...
+#   print(replayer.run())
+#
+# or from the command line, where the setup function starts the Ahsms:
+#
+#   $ python3 -m ufarc.replay traffic.log myapp:setup
+# """
+
+import pickle
+import struct
+import time
+
+import ufarc
+from ufarc.clock import VirtualClock
+
+
+# Record kinds
+POST = 1        # prio: target Ahsm, sig: event, payload: pickled value
+PUBLISH = 2     # sig: event, payload: pickled value
+TIMER = 3       # prio: target Ahsm, sig: TimeEvent's signal
+SIGNAME = 4     # sig: signal id, payload: its name (first use of a signal)
+MEMBER = 5      # prio: target LiteAhsm's AhsmGroup, sig: event,
+                # payload: pickled ( member's index in the group, value )
+
+# Record flags
+INTERNAL = 1    # posted or published by a handler while dispatching
+
+# A record is ( kind, flags, priority, signal, time, payload length )
+# followed by the payload.  A value of None has no payload.
+RECORD = "<BBhHdI"
+RECORD_SIZE = struct.calcsize(RECORD)
+
+# A log begins with the header ( magic, version )
+MAGIC = b"UFRP"
+VERSION = 1
+HEADER = "<4sH"
+
+
+class Recorder(object):
+    # """Appends the Framework's events to a log file (opened for append
+    # so several recordings may be concatenated into one log).
+    # """
+
+    def __init__(self, path):
+        self._f = open(path, "ab")
+        if self._f.tell() == 0:
+            self._f.write(struct.pack(HEADER, MAGIC, VERSION))
+        self._named = set()
+        self._members = {}  # id(LiteAhsm): its index in its group
+        self.n = 0
+
+
+    def _put(self, kind, prio, sig, value):
+        if sig not in self._named:
+            self._named.add(sig)
+            name = ufarc.Signal._lookup[sig].encode()
+            self._f.write(struct.pack(RECORD, SIGNAME, 0, -1, sig, 0.0,
+                                      len(name)))
+            self._f.write(name)
+
+        payload = b"" if value is None else pickle.dumps(value, -1)
+        flags = INTERNAL if ufarc.Framework._running else 0
+        self._f.write(struct.pack(RECORD, kind, flags, prio, sig,
+                                  ufarc.Framework._clock.time(), len(payload)))
+        if payload:
+            self._f.write(payload)
+        self.n += 1
+
+
+    # The Framework's hooks
+
+    def post(self, event, ahsm):
+        if isinstance(ahsm, ufarc.LiteAhsm):
+            self._put(MEMBER, ahsm.priority, event[ufarc.Event.SIG_IDX],
+                      (self._memberIndex(ahsm), event[ufarc.Event.VAL_IDX]))
+        else:
+            self._put(POST, ahsm.priority, event[ufarc.Event.SIG_IDX],
+                      event[ufarc.Event.VAL_IDX])
+
+
+    def publish(self, event):
+        self._put(PUBLISH, -1, event[ufarc.Event.SIG_IDX],
+                  event[ufarc.Event.VAL_IDX])
+
+
+    def timer(self, tm_event):
+        self._put(TIMER, tm_event.ahsm.priority, tm_event.sig, None)
+
+
+    def _memberIndex(self, member):
+        members = member.group.members
+        i = self._members.get(id(member))
+        if i is None or i >= len(members) or members[i] is not member:
+            i = members.index(member)
+            self._members[id(member)] = i
+        return i
+
+
+    def flush(self,):
+        self._f.flush()
+
+
+    def close(self,):
+        self._f.close()
+
+
+def load(data):
+    # """Decodes a log.  Returns a list of records
+    # ( kind, flags, priority, signal name, time, value ).
+    # """
+    magic, version = struct.unpack_from(HEADER, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a ufarc replay log (version %d)" % VERSION)
+    offset = struct.calcsize(HEADER)
+
+    names = {}
+    records = []
+    while offset < len(data):
+        kind, flags, prio, sig, t, n = struct.unpack_from(RECORD, data, offset)
+        offset += RECORD_SIZE
+        payload = data[offset:offset + n]
+        offset += n
+        if kind == SIGNAME:
+            names[sig] = bytes(payload).decode()
+        else:
+            value = pickle.loads(payload) if n else None
+            records.append((kind, flags, prio, names[sig], t, value))
+    return records
+
+
+class Replayer(object):
+    # """Replays a log's external posts and publishes.
+    # Creating a Replayer sets the Framework's clock to a VirtualClock
+    # that starts at the time of the log's first record,
+    # so it must be created before the Ahsms are started.
+    # """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.records = load(f.read())
+        start = self.records[0][4] if self.records else 0.0
+        self.clock = VirtualClock(start)
+        ufarc.Framework.setClock(self.clock)
+
+
+    def run(self, speed=None):
+        # """Replays the external posts and publishes, each at its recorded
+        # time, advancing the virtual clock (and so firing TimeEvents)
+        # in between.  With no speed the events are replayed as fast as
+        # they are dispatched; otherwise the replay sleeps so that it takes
+        # the recorded time divided by speed (e.g. 2.0 is twice as fast).
+        # Returns the number of events replayed, of TimeEvents fired
+        # and the wall time it took in seconds.
+        # """
+        Framework = ufarc.Framework
+        clock = self.clock
+        fired0 = Framework._tm_stats[1]
+        nevents = 0
+        t0 = time.perf_counter()
+        start = clock.time()
+
+        for kind, flags, prio, signame, t, value in self.records:
+            # A TimeEvent expiration is not replayed: the Ahsms' own
+            # TimeEvents expire as the clock advances.  It only marks
+            # whether TimeEvents due at the time of an event fired before it.
+            if kind == TIMER:
+                clock.run(until=t)
+                continue
+            if flags & INTERNAL:
+                continue
+            clock.run(until=t, inclusive=False)
+            if speed:
+                ahead = (t - start) / speed - (time.perf_counter() - t0)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+            sig = ufarc.Signal.register(signame)
+            if kind == POST:
+                Framework._priority_dict[prio].postFIFO((sig, value))
+            elif kind == MEMBER:
+                index, value = value
+                Framework._priority_dict[prio].members[index].postFIFO(
+                        (sig, value))
+            else:
+                Framework._fanOut((sig, value))
+            Framework.run(0)
+            nevents += 1
+
+        return {"events": nevents,
+                "timers": Framework._tm_stats[1] - fired0,
+                "seconds": time.perf_counter() - t0}
+
+
+def main(args=None):
+    import argparse
+    import importlib
+    import json
+
+    parser = argparse.ArgumentParser(
+            description="Replay a ufarc log recorded by Recorder")
+    parser.add_argument("path", help="the recorded log")
+    parser.add_argument("setup",
+            help="module:function that starts the Ahsms to replay to")
+    parser.add_argument("-s", "--speed", type=float, default=None,
+            help="replay at this multiple of the recorded speed "
+                 "(default: as fast as possible)")
+    args = parser.parse_args(args)
+
+    modname, _, funcname = args.setup.partition(":")
+    replayer = Replayer(args.path)
+    getattr(importlib.import_module(modname), funcname or "setup")()
+    result = replayer.run(args.speed)
+    result["events_per_s"] = result["events"] / result["seconds"]
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
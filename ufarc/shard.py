@@ -0,0 +1,280 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+#
+# Runs Ahsms on several cores: each shard is a process with its own
+# Framework (the Framework is a per-process singleton) and event loop,
+# so run-to-completion holds within a shard while shards run in parallel.
+#
+# Each shard is created by a setup function that runs in the shard's
+# process, starts the shard's Ahsms and exports the ones that other
+# shards may post to by name:
+#
+#   def setup_a():
+#       ping = Ping()
+#       ping.start(0)
+#       ufarc.shard.export("ping", ping)
+#       ufarc.shard.subscribe("TICK", ping)
+#
+#   shards = ufarc.shard.ShardSet([setup_a, setup_b])
+#   shards.start()
+#   shards.join()
+#
+# Within a shard, ufarc.shard.post(event, name) posts to an exported Ahsm
+# in any shard and ufarc.shard.publish(event) publishes to subscribers
+# in every shard that subscribed with ufarc.shard.subscribe().
+# Events cross shards through one multiprocessing.Queue per shard,
+# carrying the signal's name and the (pickled) value, because
+# each shard registers its own signal ids.
+#
+# The exports and subscriptions made by the setup functions are known
+# to every shard before any shard starts its event loop.  Those made later
+# reach the other shards in the order they were made, but not at once.
+# """
+
+import asyncio
+import multiprocessing
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import ufarc
+
+
+# Messages between shards
+POST = 0        # ( POST, Ahsm name, signal name, value )
+PUBLISH = 1     # ( PUBLISH, signal name, value )
+SUBSCRIBE = 2   # ( SUBSCRIBE, signal name, shard index )
+UNSUBSCRIBE = 3 # ( UNSUBSCRIBE, signal name, shard index )
+EXPORT = 4      # ( EXPORT, Ahsm name, shard index )
+READY = 5       # ( READY, shard index )
+STOP = 6        # ( STOP, )
+
+
+# The state of the shard that runs in this process
+_index = None       # this shard's index
+_queues = None      # the inbound queue of every shard (by index)
+_local = {}         # name: Ahsm exported by this shard
+_directory = {}     # name: index of the shard that exported it
+_remote_subs = {}   # signal name: indexes of other shards with subscribers
+
+
+def index():
+    # """Returns the index of the shard running in this process
+    # (None outside of a shard).
+    # """
+    return _index
+
+
+def export(name, ahsm):
+    # """Makes the Ahsm reachable by name from every shard.
+    # """
+    assert name not in _local, "Ahsm name MUST be unique"
+    _local[name] = ahsm
+    _broadcast((EXPORT, name, _index))
+
+
+def post(event, name):
+    # """Posts the event to the Ahsm exported with the given name.
+    # An event for another shard is sent to that shard (or to all of them
+    # if the name's export has not arrived yet).
+    # """
+    ahsm = _local.get(name)
+    if ahsm is not None:
+        ufarc.Framework.post(event, ahsm)
+        return
+
+    msg = (POST, name, _signame(event), event[ufarc.Event.VAL_IDX])
+    shard = _directory.get(name)
+    if shard is None:
+        _broadcast(msg)
+    else:
+        _queues[shard].put(msg)
+
+
+def publish(event):
+    # """Publishes the event to its subscribers in this shard
+    # and sends it to the other shards that have subscribers.
+    # """
+    signame = _signame(event)
+    shards = _remote_subs.get(signame)
+    if shards:
+        msg = (PUBLISH, signame, event[ufarc.Event.VAL_IDX])
+        for shard in shards:
+            _queues[shard].put(msg)
+    ufarc.Framework.publish(event)
+
+
+def subscribe(signame, ahsm):
+    # """Subscribes the Ahsm to the signal
+    # so that publish() in any shard posts to it.
+    # """
+    sigid = ufarc.Signal.register(signame)
+    first = sigid not in ufarc.Framework._subscriber_table
+    ufarc.Framework.subscribe(signame, ahsm)
+    if first:
+        _broadcast((SUBSCRIBE, signame, _index))
+
+
+def unsubscribe(signame, ahsm):
+    # """Unsubscribes the Ahsm from the signal.
+    # """
+    ufarc.Framework.unsubscribe(signame, ahsm)
+    if ufarc.Signal.register(signame) not in ufarc.Framework._subscriber_table:
+        _broadcast((UNSUBSCRIBE, signame, _index))
+
+
+def _signame(event):
+    return ufarc.Signal._lookup[event[ufarc.Event.SIG_IDX]]
+
+
+def _broadcast(msg):
+    for shard, q in enumerate(_queues):
+        if shard != _index:
+            q.put(msg)
+
+
+def _handle(msg):
+    # """Acts on a message from another shard (or the ShardSet).
+    # Returns True if the message is STOP.
+    # """
+    kind = msg[0]
+    if kind == POST:
+        ahsm = _local.get(msg[1])
+        if ahsm is not None:
+            ahsm.postFIFO(ufarc.Event(ufarc.Signal.register(msg[2]), msg[3]))
+    elif kind == PUBLISH:
+        ufarc.Framework._fanOut(ufarc.Event(ufarc.Signal.register(msg[1]), msg[2]))
+    elif kind == SUBSCRIBE:
+        _remote_subs.setdefault(msg[1], set()).add(msg[2])
+    elif kind == UNSUBSCRIBE:
+        shards = _remote_subs.get(msg[1])
+        if shards:
+            shards.discard(msg[2])
+    elif kind == EXPORT:
+        _directory[msg[1]] = msg[2]
+    elif kind == STOP:
+        return True
+    return False
+
+
+def _handleMany(msgs):
+    # """Acts on a batch of messages in the event loop
+    # and then schedules a single run to completion.
+    # """
+    stop = False
+    for msg in msgs:
+        stop = _handle(msg) or stop
+    if stop:
+        ufarc.Framework.stop()
+    else:
+        ufarc.Framework.rtc()
+
+
+def _reader():
+    # """Hands the messages from this shard's queue to the event loop
+    # in batches, so a burst of messages costs a single wakeup.
+    # """
+    q = _queues[_index]
+    loop = ufarc.Framework._event_loop
+    while True:
+        msgs = [q.get()]
+        try:
+            while True:
+                msgs.append(q.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            loop.call_soon_threadsafe(_handleMany, msgs)
+        except RuntimeError:
+            # The event loop is closed
+            return
+
+
+def _main(shard, setup, queues):
+    # """Runs a shard in its own process.
+    # """
+    global _index, _queues
+    _index = shard
+    _queues = queues
+
+    # A fresh Framework and event loop for this process
+    ufarc.Framework.reset()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ufarc.Framework._event_loop = loop
+    ufarc.Framework.setClock(ufarc.LoopClock(loop))
+
+    setup()
+
+    # Wait until every other shard has finished its setup
+    # (and so has sent its exports and subscriptions)
+    _broadcast((READY, _index))
+    waiting = len(queues) - 1
+    stop = False
+    while waiting:
+        msg = queues[_index].get()
+        if msg[0] == READY:
+            waiting -= 1
+        else:
+            stop = _handle(msg) or stop
+
+    t = threading.Thread(target=_reader, name="ufarc-shard-reader")
+    t.daemon = True
+    t.start()
+    if stop:
+        loop.call_soon(ufarc.Framework.stop)
+    ufarc.Framework.run_forever()
+
+
+class ShardSet(object):
+    # """A set of shards, one process per setup function.
+    # The setup functions must be picklable (e.g. module-level functions)
+    # when the multiprocessing context spawns its processes.
+    # """
+
+    def __init__(self, setups, context=None):
+        ctx = multiprocessing.get_context(context)
+        self._queues = [ctx.Queue() for _ in setups]
+        self._procs = [ctx.Process(target=_main, args=(n, setup, self._queues),
+                                   name="ufarc-shard-%d" % n)
+                       for n, setup in enumerate(setups)]
+
+
+    def __len__(self,):
+        return len(self._procs)
+
+
+    def start(self,):
+        for p in self._procs:
+            p.start()
+
+
+    def post(self, event, name):
+        # """Posts the event to the Ahsm exported with the given name.
+        # """
+        msg = (POST, name, _signame(event), event[ufarc.Event.VAL_IDX])
+        for q in self._queues:
+            q.put(msg)
+
+
+    def publish(self, event):
+        # """Publishes the event to its subscribers in every shard.
+        # """
+        msg = (PUBLISH, _signame(event), event[ufarc.Event.VAL_IDX])
+        for q in self._queues:
+            q.put(msg)
+
+
+    def stop(self,):
+        # """Stops every shard (which EXITs its Ahsms).
+        # """
+        for q in self._queues:
+            q.put((STOP,))
+
+
+    def join(self, timeout=None):
+        for p in self._procs:
+            p.join(timeout)
@@ -0,0 +1,242 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+#
+# A zero-copy event transport between processes (e.g. ufarc.shard shards).
+#
+# A ShmRing is a single-producer/single-consumer ring of fixed-size slots
+# in a multiprocessing.shared_memory block.  Each slot holds a signal id
+# and a payload of up to slot_size bytes.  The producer writes the payload
+# straight into a slot and the consumer reads it through a read-only
+# memoryview of the slot, so the payload is never pickled or copied:
+#
+#   ring = ShmRing(nslots=64, slot_size=2048)      # producer creates it
+#   ring.put(SIGNAL.NET_RXD, datagram)
+#
+#   ring = ShmRing.attach(name)                    # consumer attaches
+#   bridge = ShmBridge(ring, receiver, 0.001)
+#   bridge.start(1)
+#
+# The ShmBridge Ahsm polls the ring and posts each entry to the receiver
+# as the Event (sig, view).  The receiver must give the view back with
+# ring.release(view) when it is done with it; until then the slot is not
+# reused, so a receiver that holds on to views slows the producer down.
+#
+# The signal ids must mean the same in both processes, so register the
+# signals in the same order in both (or before forking).
+# """
+
+import struct
+from multiprocessing import shared_memory
+
+import ufarc
+
+
+MAGIC = b"UFSR"
+
+# The header is ( magic, number of slots, slot size ) followed by the
+# producer's count of slots written (head) and the consumer's count of
+# slots released (tail), each in its own cache line so the two processes
+# do not contend for one.  The counts are 32 bit and wrap.
+HEADER = "<4sII"
+HEAD_OFFSET = 64
+TAIL_OFFSET = 128
+COUNT = "<I"
+HEADER_SIZE = 192
+
+# Each slot is ( signal id, payload length ) followed by the payload
+SLOT_HEADER = "<II"
+SLOT_HEADER_SIZE = struct.calcsize(SLOT_HEADER)
+
+
+class ShmRing(object):
+    # """A single-producer/single-consumer ring of event slots
+    # in shared memory.  One process puts and the other gets.
+    # """
+
+    def __init__(self, nslots=64, slot_size=2048, name=None, _shm=None):
+        if _shm is None:
+            size = HEADER_SIZE + nslots * (SLOT_HEADER_SIZE + slot_size)
+            _shm = shared_memory.SharedMemory(name, create=True, size=size)
+            struct.pack_into(HEADER, _shm.buf, 0, MAGIC, nslots, slot_size)
+            struct.pack_into(COUNT, _shm.buf, HEAD_OFFSET, 0)
+            struct.pack_into(COUNT, _shm.buf, TAIL_OFFSET, 0)
+            self._owner = True
+        else:
+            magic, nslots, slot_size = struct.unpack_from(HEADER, _shm.buf, 0)
+            if magic != MAGIC:
+                raise ValueError("not a ShmRing: %s" % _shm.name)
+            self._owner = False
+        self._shm = _shm
+        self.nslots = nslots
+        self.slot_size = slot_size
+        self._stride = SLOT_HEADER_SIZE + slot_size
+
+        # The consumer's views that have not been released,
+        # oldest first, as [ view, released ] pairs
+        self._held = []
+        self._read = struct.unpack_from(COUNT, _shm.buf, TAIL_OFFSET)[0]
+
+
+    @staticmethod
+    def attach(name):
+        # """Returns the ring created (by another process) with the given name.
+        # """
+        return ShmRing(_shm=shared_memory.SharedMemory(name))
+
+
+    @property
+    def name(self,):
+        return self._shm.name
+
+
+    def __len__(self,):
+        # """Returns the number of slots written and not yet released.
+        # """
+        buf = self._shm.buf
+        return (struct.unpack_from(COUNT, buf, HEAD_OFFSET)[0]
+                - struct.unpack_from(COUNT, buf, TAIL_OFFSET)[0]) & 0xFFFFFFFF
+
+
+    def _slot(self, count):
+        return HEADER_SIZE + (count % self.nslots) * self._stride
+
+
+    # The producer's side
+
+    def reserve(self,):
+        # """Returns a writable memoryview of the next free slot's payload
+        # (slot_size bytes), or None if the ring is full.
+        # Fill it (e.g. with socket.recv_into()) and then commit() it.
+        # """
+        if len(self) == self.nslots:
+            return None
+        head = struct.unpack_from(COUNT, self._shm.buf, HEAD_OFFSET)[0]
+        offset = self._slot(head) + SLOT_HEADER_SIZE
+        return self._shm.buf[offset:offset + self.slot_size]
+
+
+    def commit(self, sig, nbytes):
+        # """Makes the reserved slot, holding nbytes of payload,
+        # available to the consumer as the given signal.
+        # """
+        assert nbytes <= self.slot_size
+        buf = self._shm.buf
+        head = struct.unpack_from(COUNT, buf, HEAD_OFFSET)[0]
+        struct.pack_into(SLOT_HEADER, buf, self._slot(head), sig, nbytes)
+        # The slot is written before the head moves past it
+        struct.pack_into(COUNT, buf, HEAD_OFFSET, (head + 1) & 0xFFFFFFFF)
+
+
+    def put(self, sig, payload):
+        # """Copies the payload into the next slot.
+        # Returns False (and puts nothing) if the ring is full.
+        # """
+        n = len(payload)
+        if n > self.slot_size:
+            raise ValueError("payload of %d bytes exceeds slot size %d"
+                             % (n, self.slot_size))
+        view = self.reserve()
+        if view is None:
+            return False
+        view[:n] = payload
+        view.release()
+        self.commit(sig, n)
+        return True
+
+
+    # The consumer's side
+
+    def get(self,):
+        # """Returns ( signal id, read-only memoryview of the payload )
+        # for the next slot, or None if there is none.
+        # The view is valid until it is given to release().
+        # """
+        buf = self._shm.buf
+        head = struct.unpack_from(COUNT, buf, HEAD_OFFSET)[0]
+        if self._read == head:
+            return None
+        offset = self._slot(self._read)
+        sig, n = struct.unpack_from(SLOT_HEADER, buf, offset)
+        offset += SLOT_HEADER_SIZE
+        view = buf[offset:offset + n].toreadonly()
+        self._read = (self._read + 1) & 0xFFFFFFFF
+        self._held.append([view, False])
+        return sig, view
+
+
+    def release(self, view):
+        # """Gives back a view returned by get() so its slot may be reused.
+        # Slots are reused in order, so a slot is freed only when
+        # every view before it has been released too.
+        # """
+        held = self._held
+        for entry in held:
+            if entry[0] is view:
+                entry[1] = True
+                break
+        else:
+            raise ValueError("view is not held")
+        view.release()
+
+        n = 0
+        while n < len(held) and held[n][1]:
+            n += 1
+        if n:
+            del held[:n]
+            buf = self._shm.buf
+            tail = struct.unpack_from(COUNT, buf, TAIL_OFFSET)[0]
+            struct.pack_into(COUNT, buf, TAIL_OFFSET, (tail + n) & 0xFFFFFFFF)
+
+
+    def close(self,):
+        # """Releases any held views and detaches from the shared memory;
+        # the process that created the ring also destroys it.
+        # """
+        for view, _ in self._held:
+            view.release()
+        self._held = []
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class ShmBridge(ufarc.Ahsm):
+    # """An Ahsm that polls a ShmRing every interval (in event loop time)
+    # and posts each entry to the receiver Ahsm as the Event (sig, view).
+    # It takes no more entries than fit in the receiver's queue.
+    # The receiver releases each view with bridge.ring.release(view).
+    # """
+
+    def __init__(self, ring, receiver, interval):
+        super().__init__(ShmBridge.initial)
+        self.ring = ring
+        self.receiver = receiver
+        self.interval = interval
+
+
+    def initial(me, event):
+        me.tm_poll = ufarc.TimeEvent("SHM_POLL")
+        return me.tran(me, ShmBridge.polling)
+
+
+    def polling(me, event):
+        sig = event[ufarc.Event.SIG_IDX]
+        if sig == ufarc.SIGNAL.ENTRY:
+            me.tm_poll.postEvery(me, me.interval)
+            return me.handled(me, event)
+
+        elif sig == ufarc.SIGNAL.SHM_POLL:
+            mq = me.receiver.mq
+            while len(mq) < mq.maxlen:
+                entry = me.ring.get()
+                if entry is None:
+                    break
+                ufarc.Framework.post(ufarc.Event(entry[0], entry[1]),
+                                     me.receiver)
+            return me.handled(me, event)
+
+        elif sig == ufarc.SIGNAL.EXIT:
+            me.tm_poll.disarm()
+            return me.handled(me, event)
+
+        return me.super(me, me.top)
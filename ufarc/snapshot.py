@@ -0,0 +1,314 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+#
+# Snapshots the Framework's Ahsms so that a restarted process may
+# carry on where the last one left off without re-initializing:
+#
+#   ufarc.snapshot.dump("ufarc.snap")       # e.g. before shutting down
+#   ...
+#   ufarc.snapshot.load("ufarc.snap")       # in place of starting the Ahsms
+#   ufarc.Framework.run_forever()
+#
+# A snapshot holds, for each Ahsm (and each LiteAhsm of an AhsmGroup),
+# its class and priority, its current state (by qualified name),
+# its attributes, its queued and deferred events, and the signals it
+# is subscribed to, plus the TimeEvents its attributes refer to with the
+# time remaining until each armed one expires.  Restoring rebuilds the
+# Framework's registry, subscriptions and timers in bulk
+# and runs no ENTRY actions.
+#
+# Attributes are pickled, so they (and the classes and state handlers)
+# must be picklable; references to Ahsms, AhsmGroups and TimeEvents are
+# kept as references.  Events are kept by signal name, but signal ids
+# held in attributes are kept as they are, so register signals in the
+# same order in both processes.  Offloaded work is not kept.
+# """
+
+import io
+import pickle
+import zlib
+
+import ufarc
+
+
+MAGIC = b"UFSN"
+VERSION = 1
+
+# Ahsm attributes that are not kept: the queues are kept as events and
+# the rest belongs to the running process
+_NOT_KEPT = ("mq", "deferred", "_stats", "_owned",
+             "postFIFO", "postLIFO", "dispatch")
+
+
+class _Pickler(pickle.Pickler):
+    # """Pickles references to Ahsms, AhsmGroups and TimeEvents by key.
+    # """
+
+    def __init__(self, f, keys, timers):
+        pickle.Pickler.__init__(self, f, -1)
+        self._keys = keys
+        self._timers = timers
+
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ufarc.TimeEvent):
+            i = self._timers.get(id(obj))
+            if i is None:
+                i = len(self._timers)
+                self._timers[id(obj)] = (i, obj)
+            else:
+                i = i[0]
+            return ("T", i)
+        if isinstance(obj, (ufarc.Ahsm, ufarc.LiteAhsm, ufarc.AhsmGroup)):
+            return self._keys.get(id(obj))
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, f, objs, timers):
+        pickle.Unpickler.__init__(self, f)
+        self._objs = objs
+        self._timers = timers
+
+
+    def persistent_load(self, pid):
+        if pid[0] == "T":
+            return self._timers[pid[1]]
+        return self._objs[pid]
+
+
+def _className(obj):
+    cls = type(obj)
+    return (cls.__module__, cls.__qualname__)
+
+
+def _findClass(name):
+    module, qualname = name
+    obj = __import__(module, None, None, ["__name__"])
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _stateName(state):
+    return getattr(state, "__qualname__", getattr(state, "__name__", None))
+
+
+def _findState(cls, qualname):
+    # """Returns the state handler of the class with the qualified name.
+    # """
+    state = getattr(cls, qualname.rsplit(".", 1)[-1], None)
+    if state is None or _stateName(state) != qualname:
+        raise ValueError("state {0} not found in {1}".format(qualname, cls))
+    return state
+
+
+def _events(q):
+    # """Returns the events in the EventQueue as ( signame, value ) tuples.
+    # """
+    events = []
+    for n in range(len(q)):
+        evt = q._buf[(q._head + n) % q.maxlen]
+        events.append((ufarc.Signal._lookup[evt[ufarc.Event.SIG_IDX]],
+                       evt[ufarc.Event.VAL_IDX]))
+    return events
+
+
+def _slots(cls):
+    names = []
+    for c in cls.__mro__:
+        for name in getattr(c, "__slots__", ()):
+            if name not in names and name not in ("state", "group", "mq"):
+                names.append(name)
+    return names
+
+
+def dumps():
+    # """Returns a snapshot of the Framework's Ahsms as bytes.
+    # """
+    Framework = ufarc.Framework
+
+    # The key of every Ahsm, AhsmGroup and LiteAhsm
+    keys = {}
+    for obj in Framework._ahsm_registry:
+        if isinstance(obj, ufarc.AhsmGroup):
+            keys[id(obj)] = ("G", obj.priority)
+            for n, member in enumerate(obj.members):
+                keys[id(member)] = ("L", obj.priority, n)
+        else:
+            keys[id(obj)] = ("A", obj.priority)
+
+    timers = {}
+    f = io.BytesIO()
+    pickler = _Pickler(f, keys, timers)
+
+    def pickled(obj):
+        f.seek(0)
+        f.truncate()
+        pickler.clear_memo()
+        pickler.dump(obj)
+        return f.getvalue()
+
+    ahsms = []
+    groups = []
+    for obj in Framework._ahsm_registry:
+        if isinstance(obj, ufarc.AhsmGroup):
+            members = []
+            for member in obj.members:
+                attrs = {}
+                for name in _slots(type(member)):
+                    if hasattr(member, name):
+                        attrs[name] = getattr(member, name)
+                members.append({
+                    "class": _className(member),
+                    "state": _stateName(member.state),
+                    "attrs": pickled(attrs),
+                    "queue": pickled(_events(member.mq) if member.mq else []),
+                })
+            groups.append({
+                "class": _className(obj),
+                "priority": obj.priority,
+                "mq_len": obj.mq_len,
+                "members": members,
+            })
+        else:
+            attrs = {}
+            for name, value in obj.__dict__.items():
+                if name not in _NOT_KEPT:
+                    attrs[name] = value
+            if obj._wm is not None:
+                # Producers awaiting the low-water mark are not kept
+                attrs["_wm"] = obj._wm[:3] + [[]]
+            ahsms.append({
+                "class": _className(obj),
+                "priority": obj.priority,
+                "state": _stateName(obj.state),
+                "attrs": pickled(attrs),
+                "mq_len": obj.mq.maxlen,
+                "queue": pickled(_events(obj.mq)),
+                "defer_len": obj.deferred.maxlen,
+                "deferred": pickled(_events(obj.deferred)),
+            })
+
+    # Every TimeEvent referenced by an attribute,
+    # with the time remaining if it is armed
+    now = Framework._clock.time()
+    tm_events = [None] * len(timers)
+    for i, tm_event in timers.values():
+        entry = tm_event._tm_entry
+        tm_events[i] = (
+            ufarc.Signal._lookup[tm_event.sig],
+            keys.get(id(tm_event.ahsm)),
+            tm_event.interval,
+            None if entry is None else max(0, entry[0] - now),
+        )
+
+    subscriptions = {}
+    for sigid, subscribers in Framework._subscriber_table.items():
+        subscriptions[ufarc.Signal._lookup[sigid]] = [
+                keys[id(ahsm)] for ahsm in subscribers if id(ahsm) in keys]
+
+    snapshot = {
+        "ahsms": ahsms,
+        "groups": groups,
+        "timers": tm_events,
+        "subscriptions": subscriptions,
+    }
+    return MAGIC + bytes([VERSION]) + zlib.compress(pickle.dumps(snapshot, -1))
+
+
+def dump(path):
+    with open(path, "wb") as f:
+        f.write(dumps())
+
+
+def loads(data):
+    # """Restores the Ahsms of a snapshot into the Framework
+    # (which should have no Ahsms) without running any ENTRY actions.
+    # Queued events are dispatched and armed TimeEvents expire
+    # once the Framework runs.  Returns the restored Ahsms and AhsmGroups.
+    # """
+    if data[:4] != MAGIC or data[4] != VERSION:
+        raise ValueError("not a ufarc snapshot (version %d)" % VERSION)
+    snapshot = pickle.loads(zlib.decompress(data[5:]))
+    Framework = ufarc.Framework
+    register = ufarc.Signal.register
+
+    # Create every object before any attribute refers to it
+    objs = {}
+    for rec in snapshot["ahsms"]:
+        cls = _findClass(rec["class"])
+        objs[("A", rec["priority"])] = cls.__new__(cls)
+    for rec in snapshot["groups"]:
+        cls = _findClass(rec["class"])
+        objs[("G", rec["priority"])] = cls.__new__(cls)
+        for n, member in enumerate(rec["members"]):
+            cls = _findClass(member["class"])
+            objs[("L", rec["priority"], n)] = cls.__new__(cls)
+    timers = [ufarc.TimeEvent(tm[0]) for tm in snapshot["timers"]]
+
+    def unpickled(data):
+        return _Unpickler(io.BytesIO(data), objs, timers).load()
+
+    restored = []
+    for rec in snapshot["ahsms"]:
+        ahsm = objs[("A", rec["priority"])]
+        ahsm.__dict__.update(unpickled(rec["attrs"]))
+        ahsm.state = _findState(type(ahsm), rec["state"])
+        ahsm.priority = rec["priority"]
+        ahsm.mq = ufarc.EventQueue(rec["mq_len"])
+        ahsm.deferred = ufarc.EventQueue(rec["defer_len"])
+        for signame, value in unpickled(rec["deferred"]):
+            ahsm.deferred.putFIFO(ufarc.Event(register(signame), value))
+        Framework.add(ahsm)
+        restored.append(ahsm)
+
+    for rec in snapshot["groups"]:
+        group = objs[("G", rec["priority"])]
+        ufarc.AhsmGroup.__init__(group, rec["mq_len"])
+        group.priority = rec["priority"]
+        for n, mrec in enumerate(rec["members"]):
+            member = objs[("L", rec["priority"], n)]
+            for name, value in unpickled(mrec["attrs"]).items():
+                setattr(member, name, value)
+            member.state = _findState(type(member), mrec["state"])
+            member.group = group
+            member.mq = None
+            group.members.append(member)
+        Framework.add(group)
+        restored.append(group)
+
+    # The queued events
+    for rec in snapshot["ahsms"]:
+        ahsm = objs[("A", rec["priority"])]
+        for signame, value in unpickled(rec["queue"]):
+            ahsm.postFIFO(ufarc.Event(register(signame), value))
+    for rec in snapshot["groups"]:
+        for n, mrec in enumerate(rec["members"]):
+            member = objs[("L", rec["priority"], n)]
+            for signame, value in unpickled(mrec["queue"]):
+                member.postFIFO(ufarc.Event(register(signame), value))
+
+    for signame, subscribers in snapshot["subscriptions"].items():
+        for key in subscribers:
+            Framework.subscribe(signame, objs[key])
+
+    # Arm the TimeEvents in bulk and schedule the callback once
+    now = Framework._clock.time()
+    for tm_event, (signame, key, interval, remaining) in zip(
+            timers, snapshot["timers"]):
+        tm_event.interval = interval
+        if key is not None:
+            tm_event.ahsm = objs[key]
+        if remaining is not None:
+            Framework._time_events.push(tm_event, now + remaining, now)
+    Framework._scheduleTimeEventCallback()
+
+    Framework.rtc()
+    return restored
+
+
+def load(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
@@ -0,0 +1,228 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+# """
+
+try:
+    import heapq
+except ImportError:
+    import uheapq as heapq
+
+
+class TimerWheel(object):
+    # """A hierarchical timing wheel TimeEvent scheduler (timer backend)
+    # for when there are very many armed TimeEvents.
+    # Use it in place of the Framework's default TimerHeap:
+    #
+    #   ufarc.Framework.setTimerBackend(TimerWheel(resolution))
+    #
+    # Time is divided into ticks of the given resolution (in event loop
+    # time units).  Each of the levels of the wheel has 2**bits slots;
+    # a slot on level n holds the TimeEvents that expire during one
+    # rotation of level n-1.  As time advances, the slots of the upper
+    # levels are cascaded down and the slots of level 0 come due.
+    # TimeEvents beyond the reach of the top level wait in an overflow list.
+    #
+    # Arming and disarming are O(1); disarmed entries are dropped when their
+    # slot is visited.  A TimeEvent fires on the first tick at or after its
+    # expiration, so it may be up to one resolution late.  TimeEvents that
+    # come due together fire in order of expiration and then in the order
+    # they were armed.
+    # """
+
+    def __init__(self, resolution, bits=6, levels=4):
+        self._res = resolution
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        self._counts = [0] * levels # entries (live or not) on each level
+        self._overflow = []         # entries beyond the top level
+        self._due = []              # heap of entries whose tick has come
+        self._tick = 0              # the current tick
+        self._seq = 0
+        self._cnt = 0
+
+        # The time and tick last returned by peek()
+        self._peek_time = None
+        self._peek_tick = 0
+
+
+    def __len__(self,):
+        return self._cnt
+
+
+    def push(self, tm_event, expiration, now):
+        # """Arms the TimeEvent to expire at the given time.
+        # A TimeEvent that is already armed is re-armed.
+        # """
+        self.discard(tm_event)
+        self._advance(int(now // self._res))
+
+        # The entry is [expiration, sequence number, TimeEvent, tick]
+        # where tick is the first tick at or after the expiration
+        entry = [expiration, self._seq, tm_event,
+                 int(-(-expiration // self._res))]
+        self._seq += 1
+        tm_event._tm_entry = entry
+        self._place(entry)
+        self._cnt += 1
+
+
+    def clear(self,):
+        for slots in self._levels:
+            for slot in slots:
+                for entry in slot:
+                    if entry[2] is not None:
+                        entry[2]._tm_entry = None
+                del slot[:]
+        for entry in self._overflow + self._due:
+            if entry[2] is not None:
+                entry[2]._tm_entry = None
+        self._counts = [0] * len(self._levels)
+        self._overflow = []
+        self._due = []
+        self._cnt = 0
+
+
+    def discard(self, tm_event):
+        # """Disarms the TimeEvent.
+        # """
+        entry = tm_event._tm_entry
+        if entry:
+            entry[2] = None
+            tm_event._tm_entry = None
+            self._cnt -= 1
+
+
+    def peek(self,):
+        due = self._due
+        while due and due[0][2] is None:
+            heapq.heappop(due)
+        if due:
+            return due[0][0]
+
+        if self._cnt == 0:
+            return None
+        tick = self._next_tick()
+        if tick is None:
+            return None
+
+        # Remember the tick so that pop() reaches it when called
+        # at the returned time despite any rounding of tick * resolution
+        self._peek_tick = tick
+        self._peek_time = tick * self._res
+        return self._peek_time
+
+
+    def pop(self, now):
+        tick = int(now // self._res)
+        if (self._peek_time is not None and now >= self._peek_time
+                and tick < self._peek_tick):
+            tick = self._peek_tick
+        self._advance(tick)
+
+        due = self._due
+        while due:
+            entry = heapq.heappop(due)
+            tm_event = entry[2]
+            if tm_event is not None:
+                tm_event._tm_entry = None
+                self._cnt -= 1
+                return entry[0], tm_event
+        return None
+
+
+    def _place(self, entry):
+        # """Puts a live entry in the slot for its tick
+        # relative to the current tick.
+        # """
+        if entry[2] is None:
+            return
+
+        tick = entry[3]
+        delta = tick - self._tick
+        if delta <= 0:
+            heapq.heappush(self._due, entry)
+            return
+
+        bits = self._bits
+        for lvl in range(len(self._levels)):
+            if delta < (1 << (bits * (lvl + 1))):
+                self._levels[lvl][(tick >> (bits * lvl)) & self._mask].append(entry)
+                self._counts[lvl] += 1
+                return
+        self._overflow.append(entry)
+
+
+    def _next_tick(self,):
+        # """Returns the next tick at which a slot must be visited,
+        # or None if the wheel is empty.
+        # """
+        nlevels = len(self._levels)
+        lvl = 0
+        while lvl < nlevels and not self._counts[lvl]:
+            lvl += 1
+        shift = self._bits * lvl
+        base = self._tick >> shift
+
+        # Only the overflow holds entries: visit at the next top rotation
+        if lvl == nlevels:
+            if self._overflow:
+                return (base + 1) << shift
+            return None
+
+        # Find the next occupied slot on the lowest occupied level,
+        # stopping at the end of the level's rotation (where the level
+        # above is cascaded)
+        slots = self._levels[lvl]
+        end = (self._mask + 1) - (base & self._mask)
+        d = 1
+        while d < end and not slots[(base + d) & self._mask]:
+            d += 1
+        return (base + d) << shift
+
+
+    def _advance(self, target):
+        # """Moves the current tick up to the target tick,
+        # visiting only the ticks at which a slot is occupied.
+        # """
+        while self._tick < target:
+            tick = self._next_tick()
+            if tick is None or tick > target:
+                self._tick = target
+                return
+            self._tick = tick
+            self._visit(tick)
+
+
+    def _visit(self, tick):
+        # """Cascades the slots of the upper levels (highest first)
+        # whose rotation begins at this tick,
+        # then moves the live entries of the level 0 slot to the due heap.
+        # """
+        bits = self._bits
+        nlevels = len(self._levels)
+
+        if tick & ((1 << (bits * nlevels)) - 1) == 0 and self._overflow:
+            entries = self._overflow
+            self._overflow = []
+            for entry in entries:
+                self._place(entry)
+
+        for lvl in range(nlevels - 1, 0, -1):
+            shift = bits * lvl
+            if tick & ((1 << shift) - 1) == 0:
+                slot = self._levels[lvl][(tick >> shift) & self._mask]
+                if slot:
+                    entries = slot[:]
+                    del slot[:]
+                    self._counts[lvl] -= len(entries)
+                    for entry in entries:
+                        self._place(entry)
+
+        slot = self._levels[0][tick & self._mask]
+        if slot:
+            self._counts[0] -= len(slot)
+            for entry in slot:
+                if entry[2] is not None:
+                    heapq.heappush(self._due, entry)
+            del slot[:]
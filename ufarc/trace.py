@@ -0,0 +1,243 @@
+# """
+# Copyright 2019 Dean Hall.  See LICENSE file for details.
+#
+# A QS/QSpy-style binary trace of the Framework.
+#
+# A Tracer records every dispatch, transition, publish and TimeEvent
+# expiration into a preallocated bytearray ring buffer of fixed-size
+# records (the oldest records are overwritten).  Nothing is formatted or
+# printed while tracing:
+#
+#   tracer = ufarc.trace.Tracer(4096)
+#   ufarc.Framework.setTracer(tracer)
+#   ...
+#   tracer.dump("ufarc.trace")
+#
+# Decode a dumped buffer offline into a timeline and the time each Ahsm
+# spent in each state:
+#
+#   $ python3 -m ufarc.trace ufarc.trace
+# """
+
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+
+import ufarc
+
+
+# Record kinds
+DISPATCH = 1    # prio: Ahsm, sig: event, a: current state
+TRAN = 2        # prio: Ahsm, a: source state, b: target state, depth: LCA depth
+PUBLISH = 3     # sig: event, a: number of subscribers posted to
+TIMER = 4       # prio: Ahsm, sig: TimeEvent's signal
+
+KIND_NAMES = {DISPATCH: "DISPATCH", TRAN: "TRAN", PUBLISH: "PUBLISH",
+              TIMER: "TIMER"}
+
+# A record is ( kind, LCA depth, priority, signal, a, b, time )
+# where time is the low 32 bits of the microsecond ticks
+RECORD = "<BBhHHHI"
+RECORD_SIZE = struct.calcsize(RECORD)
+
+# A dump is the header ( magic, version, number of state names,
+# number of signal names, number of records ), the state names and
+# signal names (each a length-prefixed UTF-8 string) and the records
+# (oldest first)
+MAGIC = b"UFTR"
+VERSION = 1
+HEADER = "<4sHHHI"
+NAME_LEN = "<H"
+
+
+class Tracer(object):
+    # """Records Framework activity into a ring buffer of nrecords records.
+    # States are recorded as small ints; the Tracer keeps their names
+    # so a dump can be decoded without the application.
+    # """
+
+    def __init__(self, nrecords=1024):
+        self._buf = bytearray(nrecords * RECORD_SIZE)
+        self._nrecords = nrecords
+        self._next = 0  # index of the next record to write
+        self._cnt = 0   # number of records in the buffer
+        self._state_ids = {}
+        self._state_names = []
+
+
+    def __len__(self,):
+        return self._cnt
+
+
+    def clear(self,):
+        self._next = 0
+        self._cnt = 0
+
+
+    def _state_id(self, state):
+        sid = self._state_ids.get(state)
+        if sid is None:
+            sid = len(self._state_names)
+            self._state_ids[state] = sid
+            self._state_names.append(getattr(state, "__qualname__",
+                                     getattr(state, "__name__", repr(state))))
+        return sid
+
+
+    def _put(self, kind, depth, prio, sig, a, b):
+        struct.pack_into(RECORD, self._buf, self._next * RECORD_SIZE,
+                         kind, depth, prio, sig, a, b,
+                         ufarc.ticks_us() & 0xFFFFFFFF)
+        self._next += 1
+        if self._next == self._nrecords:
+            self._next = 0
+        if self._cnt < self._nrecords:
+            self._cnt += 1
+
+
+    # The Framework's hooks
+
+    def dispatch(self, ahsm, event):
+        self._put(DISPATCH, 0, ahsm.priority, event[ufarc.Event.SIG_IDX],
+                  self._state_id(ahsm.state), 0)
+
+
+    def tran(self, hsm, source, target, depth):
+        self._put(TRAN, depth, getattr(hsm, "priority", -1), 0,
+                  self._state_id(source), self._state_id(target))
+
+
+    def publish(self, event, nsubscribers):
+        self._put(PUBLISH, 0, -1, event[ufarc.Event.SIG_IDX], nsubscribers, 0)
+
+
+    def timer(self, tm_event):
+        self._put(TIMER, 0, tm_event.ahsm.priority, tm_event.sig, 0, 0)
+
+
+    def dumps(self,):
+        # """Returns the trace (names and records, oldest first) as bytes.
+        # """
+        signal_names = ufarc.Signal._lookup
+        parts = [struct.pack(HEADER, MAGIC, VERSION, len(self._state_names),
+                             len(signal_names), self._cnt)]
+        for name in self._state_names + signal_names:
+            name = name.encode()
+            parts.append(struct.pack(NAME_LEN, len(name)))
+            parts.append(name)
+
+        first = (self._next - self._cnt) % self._nrecords
+        if first + self._cnt <= self._nrecords:
+            parts.append(self._buf[first * RECORD_SIZE
+                                   :(first + self._cnt) * RECORD_SIZE])
+        else:
+            parts.append(self._buf[first * RECORD_SIZE:])
+            parts.append(self._buf[:self._next * RECORD_SIZE])
+        return b"".join(parts)
+
+
+    def dump(self, path):
+        with open(path, "wb") as f:
+            f.write(self.dumps())
+
+
+def load(data):
+    # """Decodes a dump.  Returns ( state names, signal names, records )
+    # where each record is ( kind, depth, prio, sig, a, b, time ) and time
+    # is in microseconds since the first record (the 32 bit ticks are
+    # unwrapped).
+    # """
+    magic, version, nstates, nsignals, nrecords = struct.unpack_from(HEADER, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a ufarc trace (version %d)" % VERSION)
+    offset = struct.calcsize(HEADER)
+
+    names = []
+    for _ in range(nstates + nsignals):
+        n, = struct.unpack_from(NAME_LEN, data, offset)
+        offset += struct.calcsize(NAME_LEN)
+        names.append(bytes(data[offset:offset + n]).decode())
+        offset += n
+
+    records = []
+    now = 0
+    prev = None
+    for i in range(nrecords):
+        rec = struct.unpack_from(RECORD, data, offset + i * RECORD_SIZE)
+        if prev is not None:
+            now += (rec[6] - prev) & 0xFFFFFFFF
+        prev = rec[6]
+        records.append(rec[:6] + (now,))
+    return names[:nstates], names[nstates:], records
+
+
+def timeline(states, signals, records):
+    # """Returns the records as lines of text.
+    # """
+    def signame(sig):
+        return signals[sig] if sig < len(signals) else str(sig)
+
+    lines = []
+    for kind, depth, prio, sig, a, b, t in records:
+        if kind == DISPATCH:
+            what = "prio=%d sig=%s state=%s" % (prio, signame(sig), states[a])
+        elif kind == TRAN:
+            what = "prio=%d %s -> %s lca_depth=%d" % (prio, states[a],
+                                                     states[b], depth)
+        elif kind == PUBLISH:
+            what = "sig=%s subscribers=%d" % (signame(sig), a)
+        else:
+            what = "prio=%d sig=%s" % (prio, signame(sig))
+        lines.append("%12d us  %-8s %s" % (t, KIND_NAMES.get(kind, kind), what))
+    return lines
+
+
+def state_times(states, records):
+    # """Returns { priority: { state name: microseconds } }, the time each
+    # Ahsm spent in each state between the transitions in the trace.
+    # An Ahsm's state before its first transition is found from its first
+    # dispatch (if any); time after the last record is not counted.
+    # """
+    current = {}    # prio: ( state id, since )
+    spent = {}
+    end = records[-1][6] if records else 0
+    for kind, depth, prio, sig, a, b, t in records:
+        if kind == DISPATCH and prio not in current:
+            current[prio] = (a, t)
+        elif kind == TRAN:
+            if prio in current:
+                state, since = current[prio]
+                times = spent.setdefault(prio, {})
+                times[states[state]] = times.get(states[state], 0) + t - since
+            current[prio] = (b, t)
+    for prio, (state, since) in current.items():
+        times = spent.setdefault(prio, {})
+        times[states[state]] = times.get(states[state], 0) + end - since
+    return spent
+
+
+def main(args=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Decode a ufarc trace dumped by Tracer.dump()")
+    parser.add_argument("path", help="the dumped trace")
+    parser.add_argument("-q", "--quiet", action="store_true",
+            help="print only the time spent in each state")
+    args = parser.parse_args(args)
+
+    with open(args.path, "rb") as f:
+        states, signals, records = load(f.read())
+    if not args.quiet:
+        for line in timeline(states, signals, records):
+            print(line)
+        print()
+    for prio, times in sorted(state_times(states, records).items()):
+        print("prio=%d" % prio)
+        for name, us in sorted(times.items(), key=lambda x: -x[1]):
+            print("  %12d us  %s" % (us, name))
+
+
+if __name__ == "__main__":
+    main()